@@ -1,8 +1,21 @@
-from flask import Flask,request
+import json
+import time
+import uuid
+import threading
+import concurrent.futures
+from datetime import datetime
+from flask import Flask,request,Response,jsonify
 
 import run_migration
+import oracle2postgres
 app = Flask(__name__)
 
+# migrations submitted to this process, by job id. The metrics of a
+# migration are kept per process, so jobs run one at a time.
+jobs = {}
+jobs_lock = threading.Lock()
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
 
 
 #@app.route('/submit')
@@ -63,5 +76,145 @@ def form_example():
            </form>'''
 
 
+def _run_job(job, config):
+    """
+    Run a migration job on the executor thread.
+    Args:
+        job (dict): The job.
+        config (dict): Source, target and migration settings.
+    """
+    if job['cancel'].is_set():
+        job['status'] = 'cancelled'
+        job['ended'] = time.time()
+        return
+
+    job['status'] = 'running'
+    job['started'] = time.time()
+    try:
+        run_migration.run(config, cancel=job['cancel'])
+        job['status'] = 'finished'
+    except oracle2postgres.MigrationCancelled:
+        job['status'] = 'cancelled'
+    except BaseException as e:
+        # sys.exit is used for some errors, which should not stop the executor
+        job['status'] = 'failed'
+        job['error'] = repr(e)
+    finally:
+        job['ended'] = time.time()
+        job['metrics'] = _job_metrics(job)
+        oracle2postgres.dispose_engines()
+
+
+def _job_metrics(job):
+    """
+    Get the metrics of a job: the final metrics of a job that has ended,
+    or the current metrics if the migration running in this process
+    belongs to the job.
+    Args:
+        job (dict): The job.
+    """
+    if job.get('metrics') is not None:
+        return job['metrics']
+    metrics = oracle2postgres.get_metrics()
+    if job['started'] and metrics.get('started') and metrics['started'] >= job['started']:
+        return metrics
+    return None
+
+
+def _job_summary(job, tables=True):
+    """
+    Describe a job for the API, with its progress, throughput and ETA.
+    Args:
+        job (dict): The job.
+        tables (bool): Include the progress of each table.
+    """
+    summary = {x: job[x] for x in ('id', 'status', 'error')}
+    for x in ('submitted', 'started', 'ended'):
+        summary[x] = datetime.fromtimestamp(job[x]).isoformat() if job[x] else None
+
+    metrics = _job_metrics(job)
+    if metrics:
+        for x in ('rows', 'bytes', 'rows_per_second', 'elapsed_seconds', 'eta_seconds'):
+            summary[x] = metrics.get(x)
+        if tables:
+            summary['tables'] = {k: {x: v[x] for x in ('tasks', 'finished', 'running', 'rows', 'expected_rows',
+                                                       'bytes', 'rows_per_second', 'eta_seconds')}
+                                 for k, v in metrics['tables'].items()}
+    return summary
+
+
+def _get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+
+@app.route('/migrate', methods=['POST'])
+def submit_migration():
+    config = json.loads(request.data)
+    job = {'id': uuid.uuid4().hex, 'status': 'queued', 'error': None, 'submitted': time.time(),
+           'started': None, 'ended': None, 'metrics': None, 'cancel': threading.Event()}
+    with jobs_lock:
+        jobs[job['id']] = job
+    executor.submit(_run_job, job, config)
+
+    return jsonify(job_id=job['id']), 202
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    with jobs_lock:
+        job_list = sorted(jobs.values(), key=lambda x: x['submitted'])
+    return jsonify([_job_summary(x, tables=False) for x in job_list])
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify(message='Job not found'), 404
+    return jsonify(_job_summary(job))
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Stream the progress of a job as server-sent events, once a second,
+    until the job ends.
+    """
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify(message='Job not found'), 404
+
+    def events():
+        while True:
+            summary = _job_summary(job)
+            yield 'data: {}\n\n'.format(json.dumps(summary))
+            if job['ended']:
+                break
+            time.sleep(1)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Cancel a job. Tables and chunks already being copied stop after their
+    current batch, staged files already started are finished, and the rest
+    are skipped.
+    """
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify(message='Job not found'), 404
+    job['cancel'].set()
+    return jsonify(_job_summary(job, tables=False)), 202
+
+
+# metrics of the migration run by this process, for Prometheus to scrape
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(oracle2postgres.format_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,430 @@
+#!/usr/bin/python
+
+"""
+Benchmarks the copy pipeline of oracle2postgres without an Oracle database.
+
+Synthetic tables with Oracle-like columns (NUMBER, DATE, VARCHAR2, CLOB and
+RAW) are served by a fake DB-API source, and are copied by _copy_data, as in
+a migration. The rows are loaded into an in-process sink that consumes the
+COPY stream, or into a local Postgres database if a DSN is given.
+
+Each combination of batch size and worker count is run in fresh processes,
+and rows/s, MB/s, peak RSS and the time spent in each stage are reported.
+Results are saved as JSON, and can be compared with an earlier run:
+
+    python benchmark.py --rows 200000 --batch-sizes 1000,10000 --workers 1,4
+    python benchmark.py --compare benchmarks/benchmark_abc1234.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import sqlalchemy
+import sqlalchemy.dialects.oracle
+import sqlalchemy.dialects.postgresql
+
+# oracle2postgres logs to the logs directory as it is imported
+os.makedirs('logs', exist_ok=True)
+import oracle2postgres
+
+BENCHMARK_DIR = 'benchmarks'
+BENCHMARK_SCHEMA = 'benchmark'
+
+
+class _FakeLob(object):
+    """
+    Stands in for a cx_Oracle LOB locator, reading from a string or bytes.
+    """
+    def __init__(self, value):
+        self._value = value
+
+    def size(self):
+        return len(self._value)
+
+    def read(self, offset=1, amount=None):
+        if amount is None:
+            return self._value[offset - 1:]
+        return self._value[offset - 1:offset - 1 + amount]
+
+
+class _FakeCursor(object):
+    """
+    DB-API cursor that serves synthetic rows of a table, with values of the
+    Python types cx_Oracle returns, or strings if numbers and dates are
+    fetched as text. LOBs larger than the inline size are served as
+    locators after the other columns, as _extract_batches selects them.
+    Pages of a keyed query start after the id bound as the last key.
+    """
+    def __init__(self, table, rows, lob_inline_size=None, clob_size=1000, text_values=False, seed=0):
+        self.arraysize = 100
+        self.outputtypehandler = None
+        self._table = table
+        self._rows = rows
+        self._lob_inline_size = lob_inline_size
+        self._clob_size = clob_size
+        self._text_values = text_values
+        self._random = random.Random(seed)
+        self._position = 0
+        self._end = rows
+
+    def execute(self, query, binds=None):
+        binds = binds or {}
+        if not query.lstrip().upper().startswith('SELECT') or 'nls_session_parameters' in query:
+            # session settings
+            self._position = self._end = 0
+            return
+        self._position = int(binds['k0']) + 1 if 'k0' in binds else 0
+        self._end = self._rows
+        if 'batchsize' in binds:
+            self._end = min(self._rows, self._position + binds['batchsize'])
+
+    def _make_row(self, n):
+        values = []
+        lobs = []
+        for col in self._table.columns:
+            name = type(col.type).__name__
+            if name == 'NUMBER' and col.type.scale:
+                value = Decimal(self._random.randint(0, 10 ** 8)).scaleb(-col.type.scale)
+            elif name == 'NUMBER':
+                value = n
+            elif name == 'DATE':
+                value = datetime(2000, 1, 1) + timedelta(seconds=self._random.randint(0, 10 ** 9))
+            elif name == 'RAW':
+                value = bytes(self._random.getrandbits(8) for _ in range(16))
+            elif name == 'CLOB':
+                size = self._random.randint(self._clob_size // 2, self._clob_size * 3 // 2)
+                value = ('lorem ipsum\tdolor\n' * (size // 18 + 1))[:size]
+                if self._lob_inline_size:
+                    length = len(value)
+                    if length > self._lob_inline_size:
+                        lobs.append((_FakeLob(value), length))
+                        value = None
+                    else:
+                        lobs.append((None, length))
+            else:
+                value = 'value {} of {}'.format(n, col.name)[:col.type.length]
+            if self._text_values and isinstance(value, (int, Decimal)):
+                value = str(value)
+            elif self._text_values and isinstance(value, datetime):
+                value = value.strftime('%Y-%m-%d %H:%M:%S')
+            values.append(value)
+        for locator, length in lobs:
+            values.extend([locator, length])
+        return tuple(values)
+
+    def fetchmany(self, size=None):
+        size = min(size or self.arraysize, self._end - self._position)
+        data = [self._make_row(self._position + i) for i in range(size)]
+        self._position = self._position + size
+        return data
+
+    def fetchall(self):
+        return self.fetchmany(self._end - self._position)
+
+    def close(self):
+        pass
+
+
+class _FakeConnection(object):
+    """
+    Stands in for the DB-API connection of a session, handing out the fake
+    cursor.
+    """
+    def __init__(self, cursor):
+        self.connection = self
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+class _FakeSession(object):
+    """
+    Stands in for the SQLAlchemy session _copy_data reads the source with.
+    """
+    def __init__(self, cursor):
+        self._connection = _FakeConnection(cursor)
+
+    def connection(self):
+        return self._connection
+
+    def close(self):
+        pass
+
+
+class _SinkCursor(object):
+    """
+    Stands in for a psycopg2 cursor, consuming the COPY stream in memory.
+    The target types are looked up from the type mapping of the migration.
+    Other statements are ignored.
+    """
+    def __init__(self, column_types):
+        self.bytes = 0
+        self._column_types = column_types
+        self._result = []
+
+    def execute(self, query, params=None):
+        self._result = list(self._column_types.items()) if 'pg_attribute' in query else []
+
+    def fetchall(self):
+        return self._result
+
+    def copy_expert(self, query, stream, size=8192):
+        while True:
+            data = stream.read(size)
+            if not data:
+                break
+            self.bytes = self.bytes + len(data)
+
+    def close(self):
+        pass
+
+
+class _SinkConnection(object):
+    """
+    Stands in for the raw psycopg2 connection of the target engine.
+    """
+    def __init__(self, column_types):
+        self._cursor = _SinkCursor(column_types)
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _FakeEngine(object):
+    """
+    Stands in for the target engine given to _copy_data, handing out a
+    connection to the in-process sink or to a local Postgres database.
+    """
+    def __init__(self, column_types=None, dsn=None):
+        self._column_types = column_types
+        self._dsn = dsn
+
+    def raw_connection(self):
+        if self._dsn:
+            import psycopg2
+            return psycopg2.connect(self._dsn)
+        return _SinkConnection(self._column_types)
+
+
+def _make_table(name, text_columns, text_length, clob=True):
+    """
+    Build a synthetic source table, with the column types reflected from
+    Oracle.
+    Args:
+        name (str): Name of the table.
+        text_columns (int): Number of VARCHAR2 columns.
+        text_length (int): Declared length of the VARCHAR2 columns.
+        clob (bool): Include a CLOB column.
+    """
+    oracle = sqlalchemy.dialects.oracle
+    columns = [sqlalchemy.Column('id', oracle.NUMBER(10, 0), primary_key=True),
+               sqlalchemy.Column('amount', oracle.NUMBER(12, 2)),
+               sqlalchemy.Column('created', oracle.DATE()),
+               sqlalchemy.Column('payload', oracle.RAW())]
+    columns.extend([sqlalchemy.Column('text_{}'.format(i), sqlalchemy.types.VARCHAR(text_length))
+                    for i in range(text_columns)])
+    if clob:
+        columns.append(sqlalchemy.Column('notes', sqlalchemy.types.CLOB()))
+
+    return sqlalchemy.Table(name, sqlalchemy.MetaData(), *columns, schema=BENCHMARK_SCHEMA)
+
+
+def _create_target_table(target_cursor, table):
+    """
+    Create the target table on a local Postgres database.
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        table (obj): SQLAlchemy table object.
+    """
+    columns = [sqlalchemy.Column(x.name, oracle2postgres._convert_type(x.name, x.type)) for x in table.columns]
+    target = sqlalchemy.Table(table.name, sqlalchemy.MetaData(), *columns, schema=table.schema)
+    ddl = sqlalchemy.schema.CreateTable(target).compile(dialect=sqlalchemy.dialects.postgresql.dialect())
+    target_cursor.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(BENCHMARK_SCHEMA))
+    target_cursor.execute('DROP TABLE IF EXISTS {}.{}'.format(BENCHMARK_SCHEMA, table.name))
+    target_cursor.execute(str(ddl))
+    target_cursor.execute('ALTER TABLE {}.{} SET UNLOGGED'.format(BENCHMARK_SCHEMA, table.name))
+
+
+def _bench_table(n, settings):
+    """
+    Copy one synthetic table with _copy_data, and read the time spent in
+    each stage from the metrics it records. Runs in a fresh worker
+    process, so the peak RSS and the metrics are for this table.
+    Args:
+        n (int): Number of the table.
+        settings (dict): Benchmark settings.
+    """
+    table = _make_table('bench_{}'.format(n), settings['text_columns'], settings['text_length'],
+                        settings['clob_size'] > 0)
+    text_values = settings['fetch_as_text'] and settings['copy_format'] == 'text'
+    source_cursor = _FakeCursor(table, settings['rows'], settings['lob_inline_size'],
+                                settings['clob_size'], text_values, seed=n)
+
+    if settings['dsn']:
+        import psycopg2
+        connection = psycopg2.connect(settings['dsn'])
+        _create_target_table(connection.cursor(), table)
+        connection.commit()
+        target_engine = _FakeEngine(dsn=settings['dsn'])
+    else:
+        target_engine = _FakeEngine(oracle2postgres._get_converted_types(BENCHMARK_SCHEMA, table))
+
+    start = time.perf_counter()
+    oracle2postgres._copy_data(None, BENCHMARK_SCHEMA, target_engine, table, settings['batch_size'],
+                               copy_format=settings['copy_format'], queue_depth=settings['queue_depth'],
+                               checkpoint=settings['checkpoint'], batch_bytes=settings['batch_bytes'],
+                               memory_limit=settings['batch_memory'], fetch_as_text=settings['fetch_as_text'],
+                               lob_inline_size=settings['lob_inline_size'],
+                               source_session=_FakeSession(source_cursor))
+    elapsed = time.perf_counter() - start
+
+    if settings['dsn']:
+        target_cursor = connection.cursor()
+        target_cursor.execute('DROP TABLE {}.{}'.format(BENCHMARK_SCHEMA, table.name))
+        connection.commit()
+        connection.close()
+
+    metrics = oracle2postgres.get_metrics()['tables']['{}.{}'.format(BENCHMARK_SCHEMA, table.name)]
+    return {'rows': metrics['rows'], 'bytes': metrics['bytes'], 'batches': metrics['batches'],
+            'seconds': elapsed, 'fetch_seconds': metrics['fetch_seconds'],
+            'wait_seconds': metrics['wait_seconds'], 'insert_seconds': metrics['insert_seconds'],
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+
+def run_benchmark(settings, batch_size, workers):
+    """
+    Copy one table per worker concurrently, and report the throughput.
+    Args:
+        settings (dict): Benchmark settings.
+        batch_size (int): Number of rows in each batch.
+        workers (int): Number of worker processes.
+    """
+    settings = dict(settings, batch_size=batch_size)
+
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+    results = pool.starmap(_bench_table, [(n, settings) for n in range(workers)], chunksize=1)
+    pool.close()
+    pool.join()
+    elapsed = time.perf_counter() - start
+
+    rows = sum([x['rows'] for x in results])
+    nbytes = sum([x['bytes'] for x in results])
+    result = {'batch_size': batch_size, 'workers': workers, 'rows': rows, 'bytes': nbytes,
+              'seconds': elapsed, 'rows_per_second': rows / elapsed,
+              'mb_per_second': nbytes / elapsed / 1024 / 1024,
+              'peak_rss_mb': max([x['peak_rss_mb'] for x in results]),
+              'batches': sum([x['batches'] for x in results])}
+
+    # stage times are summed over the workers, so they can exceed the elapsed time
+    for key in ('fetch_seconds', 'wait_seconds', 'insert_seconds'):
+        result[key] = sum([x[key] for x in results])
+
+    return result
+
+
+def _get_label():
+    """
+    Label results with the current git revision, if there is one.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return datetime.now().strftime('%Y%m%d%H%M%S')
+
+
+def _print_results(results, baseline=None):
+    """
+    Print a table of results, with the change from a baseline run.
+    Args:
+        results (list): Results of run_benchmark.
+        baseline (dict): Earlier results, loaded from a saved file.
+    """
+    previous = {}
+    if baseline:
+        previous = {(x['batch_size'], x['workers']): x for x in baseline['results']}
+
+    header = '{:>10} {:>7} {:>12} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'batch', 'workers', 'rows/s', 'MB/s', 'RSS MB', 'fetch s', 'wait s', 'insert s')
+    if previous:
+        header = header + ' {:>9}'.format('vs base')
+    print(header)
+    for x in results:
+        line = '{:>10} {:>7} {:>12.0f} {:>8.1f} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            x['batch_size'] or 'auto', x['workers'], x['rows_per_second'], x['mb_per_second'],
+            x['peak_rss_mb'], x['fetch_seconds'], x['wait_seconds'], x['insert_seconds'])
+        base = previous.get((x['batch_size'], x['workers']))
+        if base:
+            line = line + ' {:>+8.1f}%'.format(100.0 * (x['rows_per_second'] / base['rows_per_second'] - 1))
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='rows in each table')
+    parser.add_argument('--text-columns', type=int, default=5, help='number of VARCHAR2 columns')
+    parser.add_argument('--text-length', type=int, default=100, help='declared length of VARCHAR2 columns')
+    parser.add_argument('--clob-size', type=int, default=2000, help='average CLOB size, 0 for no CLOB')
+    parser.add_argument('--lob-inline-size', type=int, default=32768, help='largest LOB fetched inline')
+    parser.add_argument('--batch-sizes', default='1000,10000',
+                        help='comma separated batch sizes, 0 to size batches from --batch-bytes')
+    parser.add_argument('--batch-bytes', type=int, default=8 * 1024 * 1024, help='byte budget for sized batches')
+    parser.add_argument('--batch-memory', type=int, default=256 * 1024 * 1024, help='memory limit for batches')
+    parser.add_argument('--workers', default='1', help='comma separated worker counts')
+    parser.add_argument('--queue-depth', type=int, default=2, help='batches read ahead of the insert')
+    parser.add_argument('--copy-format', default='text', choices=['text', 'binary'])
+    parser.add_argument('--fetch-as-text', action='store_true', help='fetch numbers and dates as strings')
+    parser.add_argument('--checkpoint', action='store_true', help='page by key and record progress')
+    parser.add_argument('--dsn', help='load into a local Postgres database instead of an in-process sink')
+    parser.add_argument('--label', help='name of this run, the git revision by default')
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    settings = {'rows': args.rows, 'text_columns': args.text_columns, 'text_length': args.text_length,
+                'clob_size': args.clob_size, 'lob_inline_size': args.lob_inline_size,
+                'batch_memory': args.batch_memory, 'queue_depth': args.queue_depth,
+                'copy_format': args.copy_format, 'fetch_as_text': args.fetch_as_text,
+                'checkpoint': args.checkpoint, 'dsn': args.dsn}
+
+    results = []
+    for batch_size in [int(x) for x in args.batch_sizes.split(',')]:
+        for workers in [int(x) for x in args.workers.split(',')]:
+            run_settings = dict(settings, batch_bytes=0 if batch_size else args.batch_bytes)
+            results.append(run_benchmark(run_settings, batch_size or 10000, workers))
+            if not batch_size:
+                results[-1]['batch_size'] = 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    _print_results(results, baseline)
+
+    label = args.label or _get_label()
+    output = args.output or os.path.join(BENCHMARK_DIR, 'benchmark_{}.json'.format(label))
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'label': label, 'date': datetime.now().isoformat(), 'settings': settings,
+                   'results': results}, f, indent=2, default=str)
+    print('Results saved to {}'.format(output))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,26 @@
+import os
 import sys
+import io
+import re
+import gzip
+import shutil
+import pickle
+import hashlib
+import itertools
+import json
+import math
+import struct
 import logging
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
 import multiprocessing
+import concurrent.futures
+import queue
+import threading
+import time
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
+import sqlalchemy.dialects.postgresql
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy import exc
 import cx_Oracle
 from sqlalchemy.dialects.postgresql import \
@@ -17,88 +34,184 @@ fn = 'migration.log'
 logfile = "logs/{}_{}".format(datetime.now().strftime("%Y_%m_%d"), fn)
 logging.basicConfig(filename=logfile, level=logging.INFO)
 
+# bytes read from a COPY stream per round trip
+COPY_BUFFER_SIZE = 65536
+
+# rows encoded together, a column at a time, for COPY
+COPY_SLICE_ROWS = 1000
+
+# bytes of fetch buffers allocated by cx_Oracle per source cursor
+FETCH_BUFFER_SIZE = 16 * 1024 * 1024
+
+# characters or bytes read from a large LOB per round trip
+LOB_READ_SIZE = 1024 * 1024
+
+# directory for the reflected schema metadata cache
+METADATA_CACHE_DIR = 'cache'
+
+# version of the cached metadata, raised when more is recorded in it
+METADATA_CACHE_VERSION = 2
+
+# table on the target database recording the progress of the migration
+PROGRESS_TABLE = 'public.oracle2postgres_progress'
+
+# table on the target database recording the high-water marks for delta loads
+WATERMARK_TABLE = 'public.oracle2postgres_watermark'
+
+# directory for the files written by a staged extract, and read by the load
+STAGE_DIR = 'staging'
+
+# name of the file listing the staged files, written when the extract completes
+STAGE_MANIFEST = 'manifest.json'
+
 # Import postgres types
 
 
-def check_for_nulls(engine, schema_list, remove=False):
+def check_for_nulls(engine, schema_list, remove=False, processes=None):
     """
-    Check for null characters in strings.
+    Check for null characters in strings. Each table is scanned once, for
+    all of its character columns, and tables are scanned concurrently.
+    Returns a dict of affected columns, keyed by 'schema.table'. The source
+    is never modified: pass the result to migrate() as
+    migration_config['null_columns'] to strip the null characters as the
+    rows are copied.
     Args:
         engine (obj): Database engine.
         schema_list (list): List of schema to remove.
-        remove (bool): Remove null characters, if found. Default False.
+        remove (bool): Remove null characters during the copy, if found.
+            Default False, which exits if null characters are found.
+        processes (int): Number of tables to scan concurrently.
     """
     msg = "\t{}: Checking source database for nulls in strings." \
         .format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"))
 
     logging.info(msg)
     null_list = []
-    con = engine.connect()
+    null_columns = {}
 
+    tables = []
     for source_schema in schema_list:
-        source_metadata = sqlalchemy.MetaData(engine, quote_schema=True)
-        source_metadata.reflect(schema=source_schema)
+        source_metadata = _reflect_schema(engine, source_schema)
+        tables.extend([(source_schema, t) for t in source_metadata.sorted_tables])
 
-        # iterate the tables
-        for t in source_metadata.sorted_tables:
-            for col in t.columns:
-                try:
-                    result = t.select().where(col.like('%' + chr(0) + '%')).execute()
-                    nulls = result.fetchone()
-                except:
-                    nulls = None
-                if nulls and len(nulls):
-                    msg = "\t{}: Null characters found in: {}.{}.{}".format(datetime.strftime(datetime.now(), "%Y-%m-%d "
-                                                                                                            "%H:%M:%S"),
-                                                                          source_schema, t.name, col.name)
+    with concurrent.futures.ThreadPoolExecutor(int(processes or multiprocessing.cpu_count())) as executor:
+        results = executor.map(lambda x: _scan_table_for_nulls(engine, *x), tables)
 
-                    logging.info(msg)
-                    null_list.append('{}.{}.{}'.format(source_schema, t.name, col.name))
-                    if remove:
-                        # remove them
-                        t.update().values({col: sqlalchemy.func.replace(col, chr(0),
-                                                                        '')}).where(
-                            col.like('%' + chr(0) + '%')).execute()
-                        con.execute("COMMIT")
-                        msg = "\t{}: Null characters removed from {}.{}.{}".format(
-                            datetime.strftime(datetime.now(), "%Y-%m-%d "
-                                                              "%H:%M:%S"), source_schema,
-                            t.name, col.name)
-                        logging.info(msg)
+        for (source_schema, t), columns in zip(tables, results):
+            if not columns:
+                continue
+
+            msg = "\t{}: Null characters found in: {}.{} columns {}".format(
+                datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), source_schema, t.name, columns)
+            logging.info(msg)
+            null_columns['{}.{}'.format(source_schema, t.name)] = columns
+            null_list.extend(['{}.{}.{}'.format(source_schema, t.name, x) for x in columns])
+
+            if remove:
+                msg = "\t{}: Null characters will be removed from {}.{} during the copy".format(
+                    datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), source_schema, t.name)
+                logging.info(msg)
 
     if null_list and not remove:
         msg = "\tNull chars must be removed from: {}".format(null_list)
-        con.close()
         logging.info(msg)
         sys.exit(msg)
 
+    return null_columns
+
+
+def _scan_table_for_nulls(engine, source_schema, table):
+    """
+    Find the character columns of a table that contain null characters,
+    using a single scan of the table. Columns of other types cannot hold
+    null characters and are skipped.
+    Args:
+        engine (obj): Database engine.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+    """
+    columns = [x for x in table.columns if isinstance(x.type, sqlalchemy.types.String)
+               and type(x.type).__name__ != 'LONG']
+    if not columns:
+        return []
+
+    # one flag per column, so the report says which columns are affected
+    flags = []
+    for col in columns:
+        instr = 'DBMS_LOB.INSTR' if isinstance(col.type, sqlalchemy.types.Text) else 'INSTR'
+        flags.append('MAX(CASE WHEN {}({}, CHR(0)) > 0 THEN 1 ELSE 0 END)'.format(instr, _quote_column(col.name)))
+    query = "SELECT {} FROM {}.{}".format(', '.join(flags), source_schema, table.name)
+
+    con = engine.connect()
+    try:
+        row = con.execute(query).fetchone()
+    except exc.DBAPIError as e:
+        msg = "\t{}.{}: Unable to check for null characters: {}".format(source_schema, table.name, e)
+        logging.error(msg)
+        row = None
     con.close()
 
+    if not row:
+        return []
 
-def connect_to_source(config):
+    return [col.name for col, flag in zip(columns, row) if flag]
+
+
+# engines shared by all phases of a migration, keyed by _engine_key
+_engines = {}
+
+
+def _engine_key(config, dbname=None):
     """
-    Connect to source database.
+    Key an engine by its connection settings and the current process, as
+    connections cannot be shared with forked worker processes.
     Args:
-        config (dict): Settings for the source database.
+        config (dict): Settings for the database.
+        dbname (str): Name of database.
     """
-    print_log = False
+    return (os.getpid(), config['host'], str(config['port']), config.get('database'),
+            config['username'], config['password'], dbname)
 
 
+def connect_to_source(config, pool_size=5):
+    """
+    Connect to source database. The engine is shared within the process and
+    backed by a cx_Oracle session pool, so each Oracle logon is reused.
+    Args:
+        config (dict): Settings for the source database.
+        pool_size (int): Maximum number of pooled sessions.
+    """
+    key = _engine_key(config)
+    if key in _engines:
+        return _engines[key]
 
+    print_log = False
     dsn_str = cx_Oracle.makedsn(config['host'], config['port'], service_name=config['database'])
-    con_string = 'oracle://{}:{}@'.format(config['username'], config['password']) + dsn_str
-    engine = sqlalchemy.create_engine(con_string, echo=print_log)
-    engine.connect()
+    session_pool = cx_Oracle.SessionPool(config['username'], config['password'], dsn_str,
+                                         min=1, max=pool_size, increment=1, threaded=True,
+                                         getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT)
+
+    # closing a pooled connection releases it back to the session pool, so
+    # SQLAlchemy does not need a pool of its own
+    engine = sqlalchemy.create_engine('oracle://', creator=session_pool.acquire,
+                                      poolclass=sqlalchemy.pool.NullPool, echo=print_log)
+    engine.connect().close()
+    _engines[key] = engine
     return engine
 
 
-def connect_to_target(config, dbname=None):
+def connect_to_target(config, dbname=None, pool_size=5):
     """
-    Connect to target database.
+    Connect to target database. The engine is shared within the process.
     Args:
         config (dict): Settings for the target database.
         dbname (str): Name of target database.
+        pool_size (int): Number of pooled connections.
     """
+    key = _engine_key(config, dbname)
+    if key in _engines:
+        return _engines[key]
+
     print_log = False
     if dbname:
         con_string = 'postgresql+psycopg2://{}:{}@{}:{}/{}'.format(config['username'],
@@ -108,11 +221,22 @@ def connect_to_target(config, dbname=None):
         con_string = 'postgresql+psycopg2://{}:{}@{}:{}'.format(config['username'],
                                                                 config['password'], config['host'], config['port'])
 
-    engine = sqlalchemy.create_engine(con_string, echo="debug")
-    engine.connect()
+    # pre-ping replaces connections closed by drop_connections
+    engine = sqlalchemy.create_engine(con_string, echo=print_log, pool_size=pool_size,
+                                      max_overflow=pool_size, pool_pre_ping=True)
+    engine.connect().close()
+    _engines[key] = engine
     return engine
 
 
+def dispose_engines():
+    """
+    Close the pooled connections of every engine created by this process.
+    """
+    for key in list(_engines):
+        if key[0] == os.getpid():
+            _engines.pop(key).dispose()
+
 
 def _clean_list(schema_list):
     """
@@ -152,326 +276,2918 @@ def check_schema_exist(engine, schema_list):
     return schema_list
 
 
-def _migrate_data(schema, source_config, target_config, migration_config):
+def _get_ddl_fingerprint(engine, schema):
     """
-    Migrate the data from the source tables to the target tables
+    Fingerprint the DDL of a schema, so cached metadata can be invalidated
+    when objects are created, dropped or altered.
     Args:
-        schema (str): Name of schema to migrate.
-        source_config (dict): Settings for source database.
-        target_config (dict): Settings for target database.
-        migration_config (dict): Settings for the migration.
+        engine (obj): Database engine.
+        schema (str): Name of schema.
     """
-    # create database connections
-    source_engine = connect_to_source(source_config)
-    target_engine = connect_to_target(target_config, target_config['database'])
-
-    # load the schema metadata profile
-    source_metadata = sqlalchemy.MetaData(source_engine)
-    source_metadata.reflect(schema=schema)
+    con = engine.connect()
+    row = con.execute(sqlalchemy.text("""
+        SELECT MAX(SYS_CONTEXT('USERENV', 'DB_NAME')), COUNT(*),
+               TO_CHAR(MAX(last_ddl_time), 'YYYY-MM-DD HH24:MI:SS')
+        FROM all_objects
+        WHERE owner = :owner"""), {'owner': engine.dialect.denormalize_name(schema)}).fetchone()
+    con.close()
 
-    # iterate the tables, loading the data
-    for t in source_metadata.sorted_tables:
-        _copy_data(source_engine, schema, target_engine, t, migration_config['batchsize'],
-                   migration_config['logged'], trialrun=migration_config['trialrun'])
+    return hashlib.sha1('|'.join([str(x) for x in (METADATA_CACHE_VERSION,) + tuple(row)])
+                        .encode('utf-8')).hexdigest()[:16]
 
 
-def create_target_schema(schema_list, source_engine, target_engine):
+def _cache_schema_metadata(engine, schema, cache_dir=METADATA_CACHE_DIR):
     """
-    Recreate the sources tables on the target database
+    Reflect a schema and save the metadata to the cache, unless the cache is
+    already up to date. Returns the path of the cache file.
     Args:
-        schema_list (list): List of schema.
-        source_engine (obj): Database engine.
-        target_engine (obj): Database engine.
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        cache_dir (str): Directory for the metadata cache.
     """
-    msg = 'Creating schema on target database...\n'
-    print(msg)
-    for source_schema in schema_list:
+    path = os.path.join(cache_dir, '{}_{}.pickle'.format(schema, _get_ddl_fingerprint(engine, schema)))
+    if os.path.exists(path):
+        return path
 
-        # load the schema metadata profile
-        print(source_schema)
-        source_metadata = sqlalchemy.MetaData(source_engine, quote_schema=True)
-        source_metadata.reflect(schema=source_schema)
+    msg = "\t{}: Reflecting schema metadata".format(schema)
+    logging.info(msg)
 
-        # create the schema on the target database
-        target_engine.execute(sqlalchemy.schema.CreateSchema(source_schema))
+    metadata = sqlalchemy.MetaData(engine, quote_schema=True)
+    metadata.reflect(schema=schema)
+    _reflect_partitions(engine, schema, metadata)
+    metadata.bind = None
 
-        # iterate the tables
-        for t in source_metadata.sorted_tables:
+    # write to a temporary file first, as workers may be reading the cache
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(metadata, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
 
-            # clear the indexes and constraints
-            t.indexes.clear()
-            t.constraints.clear()
+    # remove metadata cached for earlier versions of the schema. The name is
+    # matched exactly, as other schemas may start with the same prefix
+    pattern = re.compile(r'^{}_[0-9a-f]{{16}}\.pickle$'.format(re.escape(schema)))
+    for name in os.listdir(cache_dir):
+        old_path = os.path.join(cache_dir, name)
+        if pattern.match(name) and old_path != path:
+            os.remove(old_path)
 
-            # clean the data types
-            for col in t.columns:
+    return path
 
-                # set the column types
-                newtype = _convert_type(col.name, col.type,
-                                        schema_name=source_schema, table_name=t.name)
-                t.c[col.name].type = newtype
 
-                # check the default values
-                if t.c[col.name].default:
-                    new_default = _check_default(t.c[col.name].default)
-                    t.c[col.name].default = new_default
+def _reflect_partitions(engine, schema, metadata):
+    """
+    Record the partitioning of the partitioned tables of a schema in
+    table.info['partitioning']: the partitioning type, the partition key
+    columns and the partitions in order, with the HIGH_VALUE text and
+    estimated row count of each. Tables with subpartitions are recorded
+    by their top level partitions.
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        metadata (obj): Metadata reflected from the schema.
+    """
+    owner = engine.dialect.denormalize_name(schema)
+    normalize_name = engine.dialect.normalize_name
+    con = engine.connect()
+    try:
+        tables = con.execute(sqlalchemy.text("""
+            SELECT table_name, partitioning_type, subpartitioning_type
+            FROM all_part_tables
+            WHERE owner = :owner"""), {'owner': owner}).fetchall()
+        key_columns = con.execute(sqlalchemy.text("""
+            SELECT name, column_name
+            FROM all_part_key_columns
+            WHERE owner = :owner
+            AND object_type = 'TABLE'
+            ORDER BY name, column_position"""), {'owner': owner}).fetchall()
+        partitions = con.execute(sqlalchemy.text("""
+            SELECT table_name, partition_name, high_value, num_rows
+            FROM all_tab_partitions
+            WHERE table_owner = :owner
+            ORDER BY table_name, partition_position"""), {'owner': owner}).fetchall()
+    except exc.DBAPIError:
+        msg = "\t{}: Unable to read the partitioning of tables".format(schema)
+        logging.info(msg)
+        return
+    finally:
+        con.close()
 
-                # remove the server_default values
-                if t.c[col.name].server_default:
-                    t.c[col.name].server_default = None
+    columns = {}
+    for table_name, column in key_columns:
+        columns.setdefault(normalize_name(table_name), []).append(normalize_name(column))
 
-                    # Build the tables on the target database
-        source_metadata.create_all(target_engine, checkfirst=False)
+    table_partitions = {}
+    for table_name, partition_name, high_value, num_rows in partitions:
+        table_partitions.setdefault(normalize_name(table_name), []).append(
+            {'name': partition_name, 'high_value': high_value, 'rows': num_rows})
 
-        msg = "\t{}: Target schema created: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"),
-                                                     source_schema)
-        logging.info(msg)
+    for table_name, partitioning_type, subpartitioning_type in tables:
+        t = metadata.tables.get('{}.{}'.format(schema, normalize_name(table_name)))
+        if t is not None:
+            t.info['partitioning'] = {'type': partitioning_type, 'subpartitioning': subpartitioning_type,
+                                      'columns': columns.get(normalize_name(table_name), []),
+                                      'partitions': table_partitions.get(normalize_name(table_name), [])}
 
 
-def drop_connections(dbname, engine):
+def _load_metadata(path, engine=None):
     """
-    Closes connections to a database to avoid any interference
-    with the migration.
+    Load metadata from the cache. Each call returns a new copy, so the
+    tables can be modified by the caller.
+    Args:
+        path (str): Path of the cache file.
+        engine (obj): Database engine to bind the metadata to.
+    """
+    with open(path, 'rb') as f:
+        metadata = pickle.load(f)
+    metadata.bind = engine
+
+    return metadata
+
+
+def _reflect_schema(engine, schema, cache_dir=METADATA_CACHE_DIR):
+    """
+    Get the metadata for a source schema, reflecting it only if the schema
+    has changed since it was last cached.
     Args:
-        dbname (str): Name of database.
         engine (obj): Database engine.
+        schema (str): Name of schema.
+        cache_dir (str): Directory for the metadata cache.
     """
-    con = engine.connect()
-    con.execute("COMMIT")  # need to close current transaction
-    con.execute("""
-        SELECT pg_terminate_backend(pid) 
-        FROM pg_stat_activity 
-        WHERE datname = '{}';""".format(dbname))
-    con.execute("COMMIT")  # need to close current transaction
-    con.close()
+    return _load_metadata(_cache_schema_metadata(engine, schema, cache_dir), engine)
 
 
-def drop_database(dbname, engine):
+# metadata loaded by the current process, keyed by cache file path
+_loaded_metadata = {}
+
+
+def _get_cached_table(path, engine, schema, table_name):
     """
-    Warning, drops the specified database!
+    Get a table from cached metadata. The metadata is loaded once per
+    process and shared, so the table must not be modified.
     Args:
-        dbname (str): Name of database to drop.
+        path (str): Path of the cache file.
         engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
     """
+    if path not in _loaded_metadata:
+        _loaded_metadata[path] = _load_metadata(path, engine)
+    elif engine is not None:
+        _loaded_metadata[path].bind = engine
 
-    # msg =  """
-    # --------------------------------------------------------- \n
-    # Warning, you are about to delete the following database!  \n
-    # {}.{}
-    # Are you sure you wish to continue?                        \n
-    # Type 'yes' to proceed.                                    \n
-    # --------------------------------------------------------- \n
-    # \n""".format(engine.name,dbname)
-    #
-    # if input(msg).lower() != "yes":
-    #     sys.exit()
+    return _loaded_metadata[path].tables['{}.{}'.format(schema, table_name)]
+
+
+def _init_worker(source_config, target_config, metrics_queue=None, cancel_event=None):
+    """
+    Create the database engines for a worker process. Called once when each
+    worker in the pool starts. A worker copies one table at a time, so only
+    needs a couple of connections to each database.
+    Args:
+        source_config (dict): Settings for source database, or None if the
+            workers do not read the source, e.g. to load staged files.
+        target_config (dict): Settings for target database, or None if the
+            workers do not write to the target, e.g. to stage files.
+        metrics_queue (obj): Queue to send metrics to the main process on.
+        cancel_event (obj): Event set when the migration is cancelled.
+    """
+    global _metrics_queue, _cancel_event
+    _metrics_queue = metrics_queue
+    _cancel_event = cancel_event
+
+    if source_config:
+        connect_to_source(source_config, pool_size=2)
+    if target_config:
+        connect_to_target(target_config, target_config['database'], pool_size=2)
 
+
+def _get_table_sizes(engine, schema):
+    """
+    Get the size in bytes of each table in a schema, including its LOB
+    segments. Falls back to the optimizer statistics if the segment views
+    are not accessible.
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+    """
+    owner = engine.dialect.denormalize_name(schema)
     con = engine.connect()
-    con.execute("COMMIT")  # need to close current transaction
-    con.execute("DROP DATABASE IF EXISTS {}".format(dbname))
-    con.execute("COMMIT")  # need to close current transaction
+    try:
+        result = con.execute(sqlalchemy.text("""
+            SELECT NVL(l.table_name, s.segment_name), SUM(s.bytes)
+            FROM dba_segments s
+            LEFT JOIN dba_lobs l ON l.owner = s.owner AND l.segment_name = s.segment_name
+            WHERE s.owner = :owner
+            AND (s.segment_type LIKE 'TABLE%' OR s.segment_type LIKE 'LOB%')
+            GROUP BY NVL(l.table_name, s.segment_name)"""), {'owner': owner}).fetchall()
+    except exc.DBAPIError:
+        msg = "\t{}: Unable to read dba_segments, using table statistics for sizes".format(schema)
+        logging.info(msg)
+        result = con.execute(sqlalchemy.text("""
+            SELECT table_name, NVL(num_rows, 0) * NVL(avg_row_len, 0)
+            FROM all_tables
+            WHERE owner = :owner"""), {'owner': owner}).fetchall()
     con.close()
-    msg = "\t{}: Target database dropped: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), dbname)
-    logging.info(msg)
 
+    return {engine.dialect.normalize_name(name): int(size or 0) for name, size in result}
 
-def create_database(dbname, engine):
+
+def _get_row_widths(engine, schema, sizes):
     """
-    Creates a new database on the target.
+    Estimate the average size in bytes of a row of each table in a schema.
+    AVG_ROW_LEN leaves out LOBs stored out of line, so the segment size per
+    row is used where it is larger.
     Args:
-        dbname (str): Name of database.
         engine (obj): Database engine.
+        schema (str): Name of schema.
+        sizes (dict): Size in bytes of each table, from _get_table_sizes.
     """
     con = engine.connect()
-    con.execute("COMMIT")  # need to close current transaction
-    con.execute("CREATE DATABASE {}".format(dbname))
-    con.execute("COMMIT")
+    result = con.execute(sqlalchemy.text("""
+        SELECT table_name, num_rows, avg_row_len
+        FROM all_tables
+        WHERE owner = :owner"""), {'owner': engine.dialect.denormalize_name(schema)}).fetchall()
     con.close()
-    msg = "\t{}: Target database created: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), dbname)
-    logging.info(msg)
 
+    widths = {}
+    for name, num_rows, avg_row_len in result:
+        name = engine.dialect.normalize_name(name)
+        width = avg_row_len or 0
+        if num_rows:
+            width = max(width, sizes.get(name, 0) // num_rows)
+        widths[name] = int(width) or None
 
-def _check_default(default):
-    new_default = default
-    logging.info("CHECKING DEFAULT")
+    return widths
 
-    if str(default).lower() == "sysdate":
-        logging.info("UPDATED")
-        new_default = None
 
-    return new_default
+def _get_table_tasks(source_engine, schema_list, migration_config):
+    """
+    Build the list of tables to migrate, largest first, so the longest
+    tables start early and the pool stays busy until the end. Tables with
+    a parallel degree above 1 are split into chunks that are migrated
+    concurrently.
+    Args:
+        source_engine (obj): Database engine.
+        schema_list (list): List of schema.
+        migration_config (dict): Settings for the migration.
+    """
+    tasks = []
+    for schema in schema_list:
+        metadata_path = _cache_schema_metadata(source_engine, schema)
+        sizes = _get_table_sizes(source_engine, schema)
+        widths = _get_row_widths(source_engine, schema, sizes)
+        for t in _load_metadata(metadata_path).sorted_tables:
+            table_name = t.name
+            size = sizes.get(table_name, 0)
+            degree = _get_parallel_degree(migration_config, schema, table_name)
+            chunks = []
+            if t.info.get('partitioning'):
+                chunks = _split_by_partition(schema, t)
+            elif degree > 1:
+                chunks = _split_table(source_engine, schema, table_name, degree,
+                                      migration_config.get('split_method', 'rowid'))
+            if len(chunks) > 1:
+                # partitions are sized by their share of the rows
+                rows = {}
+                if t.info.get('partitioning'):
+                    rows = {x['name']: x['rows'] or 0 for x in t.info['partitioning']['partitions']}
+                total_rows = sum(rows.values())
+                for chunk in chunks:
+                    chunk_size = size // len(chunks)
+                    if total_rows:
+                        chunk_size = size * rows[chunk['partition']] // total_rows
+                    tasks.append({'schema': schema, 'table': table_name, 'metadata': metadata_path,
+                                  'size': chunk_size, 'row_bytes': widths.get(table_name),
+                                  'chunk': chunk})
+            else:
+                tasks.append({'schema': schema, 'table': table_name, 'metadata': metadata_path,
+                              'size': size, 'row_bytes': widths.get(table_name), 'chunk': None})
+
+    tasks.sort(key=lambda x: x['size'], reverse=True)
+
+    return tasks
 
 
-def _insert_data(target_session, table, data):
+def _get_parallel_degree(migration_config, schema, table_name):
     """
-    Inserts the data into the target system. Disables integrity checks 
-    prior to inserting.
+    Get the number of chunks a table is split into. Set per table with
+    migration_config['table_parallelism'] = {'schema.table': n}, or for all
+    tables with migration_config['parallel_degree'].
     Args:
-        target_session (obj): SQLAlchemy session.
-        table (obj): SQLAlchemy table object.
-        data (obj): SQLAlchemy data object.
+        migration_config (dict): Settings for the migration.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
     """
-    if data:
-        # disable integrity checks
-        target_session.execute("SET session_replication_role = replica;")
-        # insert data
-        target_session.execute(table.insert(), data)
-        # enable integrity checks
-        target_session.execute("SET session_replication_role = DEFAULT;")
-        target_session.commit()
+    table_parallelism = migration_config.get('table_parallelism') or {}
+    degree = table_parallelism.get('{}.{}'.format(schema, table_name),
+                                   migration_config.get('parallel_degree', 1))
+    return int(degree or 1)
 
 
-def _get_column_string(table):
+def _split_table(engine, schema, table_name, degree, method='rowid'):
     """
-    Create a string of column names for contructing a query.
+    Split a table into chunks that can be extracted concurrently. Rowid
+    chunks are built from the extent map, falling back to ranges of the
+    leading primary key column if the extents are not accessible.
     Args:
-        table (obj): SQLAlchemy table object.
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        degree (int): Number of chunks.
+        method (str): Either 'rowid' or 'pk'.
     """
-    column_list = table.columns.keys()
+    chunks = []
+    if method == 'rowid':
+        chunks = _split_by_rowid(engine, schema, table_name, degree)
+    if not chunks:
+        chunks = _split_by_key(engine, schema, table_name, degree)
 
-    # quote columns that are also keywords. 
-    # assume they are upper case!
-    keywords = ['where', 'from', 'select', 'comment', 'order']
-    column_list = ['"{}"'.format(x.upper()) if x.lower() in keywords else x for x in column_list]
-    column_str = ', '.join(column_list)
+    msg = "\t{}.{}: Split into {} chunks".format(schema, table_name, len(chunks))
+    logging.info(msg)
 
-    return column_str
+    return chunks
 
 
-def _copy_data(source_engine,source_schema,target_engine,table,
-               batchsize=10000,logged=True,trialrun=False):
+def _split_by_rowid(engine, schema, table_name, degree):
     """
-    Copies the data into the target system. Disables integrity checks
-    prior to inserting.
+    Split a table into rowid ranges of roughly equal numbers of blocks,
+    using the extents of the table segments. Each chunk covers a run of
+    consecutive extents. Each range ends where the next one starts, and
+    the first and last ranges are open, so rows in extents allocated
+    after the split are still copied.
     Args:
-        source_engine (obj): Database engine.
-        source_schema (obj): Name of schema to migrate.
-        target_engine (obj): Database engine.
-        table (obj): SQLAlchemy table object.
-        batchsize (int): Number of rows to migrate in each batch.
-        logged (bool): Enable or disable Postgres logging.
-        trialrun (bool): Run in trial mode.
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        degree (int): Number of chunks.
     """
-    # create sessions
+    con = engine.connect()
+    try:
+        extents = con.execute(sqlalchemy.text("""
+            SELECT DBMS_ROWID.ROWID_CREATE(1, o.data_object_id, e.relative_fno, e.block_id, 0),
+                   e.blocks
+            FROM dba_extents e
+            JOIN dba_objects o ON o.owner = e.owner
+                AND o.object_name = e.segment_name
+                AND NVL(o.subobject_name, '-') = NVL(e.partition_name, '-')
+            WHERE e.owner = :owner
+            AND e.segment_name = :table_name
+            AND e.segment_type LIKE 'TABLE%'
+            AND o.object_type LIKE 'TABLE%'
+            ORDER BY o.data_object_id, e.relative_fno, e.block_id"""),
+            {'owner': engine.dialect.denormalize_name(schema),
+             'table_name': engine.dialect.denormalize_name(table_name)}).fetchall()
+    except exc.DBAPIError:
+        msg = "\t{}.{}: Unable to read dba_extents".format(schema, table_name)
+        logging.info(msg)
+        extents = []
+    con.close()
 
-    SourceSession = sessionmaker(bind=source_engine)
-    source_session = SourceSession()
-    TargetSession = sessionmaker(bind=target_engine)
-    target_session = TargetSession()
+    if not extents:
+        return []
 
-    # print schema
-    msg = '\tBegan copy of {}.{} at {}'.format(source_schema,table.name,
-                                             datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
-    logging.info(msg)
+    # cut the extent list into runs of roughly total_blocks / degree blocks
+    total_blocks = sum([x[1] for x in extents])
+    target = total_blocks / float(degree)
+    chunks = []
+    start = None
+    blocks = 0
+    for i, (low, extent_blocks) in enumerate(extents):
+        if start is None:
+            start = low
+        blocks = blocks + extent_blocks
+        if blocks >= target * (len(chunks) + 1) or i == len(extents) - 1:
+            chunks.append({'id': 'rowid:{}'.format(len(chunks)), 'type': 'rowid',
+                           'lo': start, 'hi': None})
+            start = None
 
-    target_session.execute("SET SEARCH_PATH TO {};".format(source_schema))
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        chunk['hi'] = next_chunk['lo']
+    chunks[0]['lo'] = None
 
-    # switch off logging
-    logswitch = False
-    if not logged:
-        try:
-            target_session.execute('ALTER TABLE "{}" SET UNLOGGED'.format(table.name))
-            logswitch = True
-        except:
-            target_session.rollback()
-            target_session.execute("SET SEARCH_PATH TO {};".format(source_schema))
-            msg = "Unable to disable logging for {}.{}".format(source_schema,table.name)
-            logging.info(msg)
+    return chunks
 
-    columns = _get_column_string(table)
-
-    # # copy the data in batches
-    # if trialrun:
-    #     r = source_session.query(table).limit(200)
-    #     data = r.all()
-    #     _insert_data(target_session,table,data)
-    # else:
-    #     for data in source_session.query(table).yield_per(batchsize):
-    #         _insert_data(target_session,table,data)
-
-    # get the initial data batch
-    offset = 0
-    query =  """SELECT {} 
-                FROM {}.{} 
-                ORDER BY rowid 
-                OFFSET {} ROWS 
-                FETCH NEXT {} ROWS ONLY""".format(columns,source_schema,
-                                                  table.name,offset,batchsize)
-    data = source_session.execute(query).fetchall()
-
-    while data:
-        # insert the data
-        _insert_data(target_session,table,data)
-
-        # print summary
-        msg = '\tCopied rows {}-{} of {}.{} at {}'.format(offset,offset+batchsize,
-            source_schema,table.name, datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
-        logging.info(msg)
 
-        # break after a couple of loops
-        if trialrun and offset > 1:
-            break
+def _split_by_key(engine, schema, table_name, degree):
+    """
+    Split a table into ranges of its leading primary key column, with
+    boundaries at NTILE bucket minimums. Each range includes its lower
+    bound and excludes its upper bound.
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        degree (int): Number of chunks.
+    """
+    primary_key = sqlalchemy.inspect(engine).get_pk_constraint(table_name, schema=schema)
+    if not primary_key or not primary_key.get('constrained_columns'):
+        return []
 
-        # update the offset
-        offset = offset + batchsize
-        query =  """SELECT {} 
-                    FROM {}.{} 
-                    ORDER BY rowid 
-                    OFFSET {} ROWS 
-                    FETCH NEXT {} ROWS ONLY""".format(columns,source_schema,
-                                                      table.name,offset,batchsize)
+    column = primary_key['constrained_columns'][0]
+    con = engine.connect()
+    result = con.execute(sqlalchemy.text("""
+        SELECT MIN({col})
+        FROM (SELECT {col}, NTILE(:degree) OVER (ORDER BY {col}) AS bucket
+              FROM {schema}.{table})
+        GROUP BY bucket
+        ORDER BY 1""".format(col=_quote_column(column), schema=schema, table=table_name)),
+        {'degree': degree}).fetchall()
+    con.close()
 
-        # load the next chunk of data
-        try:
-            data = source_session.execute(query).fetchall()
-        except:
-            # break if end of table is reached
-            data = None
-            break
+    bounds = [None] + [x[0] for x in result[1:]] + [None]
+    chunks = [{'id': 'pk:{}'.format(i), 'type': 'pk', 'column': column,
+               'lo': bounds[i], 'hi': bounds[i + 1]} for i in range(len(result))]
 
-    # switch on database logging
-    if logswitch:
-        target_session.execute('ALTER TABLE "{}" SET LOGGED'.format(table.name))
+    return chunks
 
-    # record end
-    msg = '\tFinished copy of {}.{} at {}'.format(source_schema,table.name,
-                                                datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+
+def _split_by_partition(schema, table):
+    """
+    Split a partitioned table into its partitions, which are read with
+    SELECT ... PARTITION (p). Range and list partitions are copied straight
+    into the matching partition of the target table. Hash partitions are
+    copied into the target table, which routes each row, as Postgres does
+    not hash rows to the same partitions as Oracle.
+    Args:
+        schema (str): Name of schema.
+        table (obj): SQLAlchemy table object, reflected from the source.
+    """
+    partitioning = table.info['partitioning']
+    recreated = _get_partition_ddl(schema, table) is not None and partitioning['type'] != 'HASH'
+
+    chunks = []
+    for partition in partitioning['partitions']:
+        chunks.append({'id': 'partition:{}'.format(partition['name']), 'type': 'partition',
+                       'partition': partition['name'],
+                       'target': _get_partition_table_name(table, partition) if recreated else None})
+
+    msg = "\t{}.{}: Split into {} partitions".format(schema, table.name, len(chunks))
     logging.info(msg)
 
-    # close the sessions
-    source_session.close()
-    target_session.close()
+    return chunks
 
 
-def _convert_type(colname, ora_type, schema_name='',
-                  table_name=''):
+def _get_partition_table_name(table, partition):
     """
-    Converts a data type in the source (Oracle) database to a Postgres type.
+    Name the target table of a partition, e.g. sales_p2020 for partition
+    P2020 of table sales.
     Args:
-        colname (str): Name of the column.
-        ora_type (obj): Data type in the source (Oracle) database.
-        schema_name (str): Name of the schema.
-        table_name (str): Name of the table.
+        table (obj): SQLAlchemy table object.
+        partition (dict): Partition, from table.info['partitioning'].
     """
-    pg_type = ora_type
+    name = partition['name']
+    if name == name.upper():
+        name = name.lower()
+    return '{}_{}'.format(table.name, name)
 
-    # "NullType is used as a default type for those cases 
-    # where a type cannot be determined"
-    # NB: this needs to be first in the list
-    # Otherwise str(ora_type) clauses will error
-    if isinstance(ora_type, sqlalchemy.types.NullType):
-        pg_type = sqlalchemy.types.String()
-        logging.info('\t{}.{}.{}: NULL DETECTED'.format(schema_name, table_name,
-                                                        colname))
-        return pg_type
-    elif isinstance(ora_type, sqlalchemy.types.Numeric):
-        pg_type = sqlalchemy.types.Numeric()
-    elif isinstance(ora_type, sqlalchemy.types.DateTime):
-        pg_type = TIMESTAMP()
-    elif isinstance(ora_type, sqlalchemy.types.Text):
-        pg_type = sqlalchemy.types.Text()
-    elif isinstance(ora_type, sqlalchemy.types.NVARCHAR):
-        pg_type = sqlalchemy.types.VARCHAR()
-    elif isinstance(ora_type, sqlalchemy.types.BLOB):
+
+def _split_high_value(high_value):
+    """
+    Split the HIGH_VALUE text of a partition into the values of each
+    partition key column, or of each list value, at the commas outside
+    quotes and brackets.
+    Args:
+        high_value (str): HIGH_VALUE from ALL_TAB_PARTITIONS.
+    """
+    values = []
+    current = ''
+    depth = 0
+    quoted = False
+    for c in high_value:
+        if c == "'":
+            quoted = not quoted
+        elif not quoted and c == '(':
+            depth = depth + 1
+        elif not quoted and c == ')':
+            depth = depth - 1
+        elif not quoted and not depth and c == ',':
+            values.append(current.strip())
+            current = ''
+            continue
+        current = current + c
+    values.append(current.strip())
+
+    return values
+
+
+def _convert_bound(value):
+    """
+    Convert a partition bound from Oracle to Postgres. Returns None if the
+    bound is an expression that cannot be converted.
+    Args:
+        value (str): One value from the HIGH_VALUE of a partition.
+    """
+    if value.upper() in ('MAXVALUE', 'DEFAULT', 'NULL'):
+        return value.upper()
+
+    # dates are given as TO_DATE(' 2020-01-01 00:00:00', 'SYYYY-MM-DD HH24:MI:SS', ...),
+    # with a space for the sign of the year
+    match = re.match(r"^(?:TO_DATE\(\s*|TIMESTAMP\s*)'\s*([0-9][^']*)'", value, re.IGNORECASE)
+    if match:
+        return "'{}'".format(match.group(1).strip())
+
+    if re.match(r"^-?[0-9]*\.?[0-9]+(E[+-]?[0-9]+)?$", value, re.IGNORECASE) or \
+            re.match(r"^'(?:[^']|'')*'$", value):
+        return value
+
+    return None
+
+
+def _get_partition_ddl(source_schema, table):
+    """
+    Translate the partitioning of a source table to Postgres declarative
+    partitioning. Returns the PARTITION BY clause of the table and the
+    statements that create its partitions, or None if the table is not
+    partitioned, or is partitioned in a way that cannot be translated.
+    Args:
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object, reflected from the source.
+    """
+    partitioning = table.info.get('partitioning')
+    if not partitioning or not partitioning['columns'] or not partitioning['partitions'] or \
+            partitioning['type'] not in ('RANGE', 'LIST', 'HASH'):
+        return None
+
+    parent = '{}.{}'.format(_quote_ident(source_schema), _quote_ident(table.name))
+    columns = partitioning['columns']
+    partitions = partitioning['partitions']
+    statements = []
+
+    # a range partition holds the values from the bound of the one before
+    lower = ['MINVALUE'] * len(columns)
+    for i, partition in enumerate(partitions):
+        if partitioning['type'] == 'HASH':
+            bound = 'FOR VALUES WITH (MODULUS {}, REMAINDER {})'.format(len(partitions), i)
+        else:
+            values = [_convert_bound(x) for x in _split_high_value(partition['high_value'] or '')]
+            if None in values:
+                return None
+            elif partitioning['type'] == 'LIST' and values == ['DEFAULT']:
+                bound = 'DEFAULT'
+            elif partitioning['type'] == 'LIST':
+                bound = 'FOR VALUES IN ({})'.format(', '.join(values))
+            elif values == ['MAXVALUE'] * len(columns):
+                # Oracle puts null keys in the MAXVALUE partition, and Postgres
+                # only in the default partition
+                bound = 'DEFAULT'
+            elif len(values) == len(columns):
+                bound = 'FOR VALUES FROM ({}) TO ({})'.format(', '.join(lower), ', '.join(values))
+                lower = values
+            else:
+                return None
+        statements.append('CREATE TABLE {}.{} PARTITION OF {} {}'.format(
+            _quote_ident(source_schema), _quote_ident(_get_partition_table_name(table, partition)), parent, bound))
+
+    return '{} ({})'.format(partitioning['type'], ', '.join([_quote_ident(x) for x in columns])), statements
+
+
+def _chunk_predicate(chunk):
+    """
+    Build the predicate and bind values that restrict a query to a chunk.
+    Partitions are read with a PARTITION clause instead.
+    Args:
+        chunk (dict): Chunk returned by _split_table, or None.
+    """
+    if not chunk or chunk['type'] == 'partition':
+        return None, {}
+
+    terms = []
+    binds = {}
+    if chunk['type'] == 'rowid':
+        if chunk['lo'] is not None:
+            terms.append('rowid >= CHARTOROWID(:lo)')
+            binds['lo'] = chunk['lo']
+        if chunk['hi'] is not None:
+            terms.append('rowid < CHARTOROWID(:hi)')
+            binds['hi'] = chunk['hi']
+        return ' AND '.join(terms), binds
+
+    if chunk['lo'] is not None:
+        terms.append('{} >= :lo'.format(_quote_column(chunk['column'])))
+        binds['lo'] = chunk['lo']
+    if chunk['hi'] is not None:
+        terms.append('{} < :hi'.format(_quote_column(chunk['column'])))
+        binds['hi'] = chunk['hi']
+
+    return ' AND '.join(terms), binds
+
+
+def _set_logged(target_engine, tasks, logged, processes=None):
+    """
+    Switch Postgres logging (WAL) on or off for the tables being migrated.
+    This is done once per table, outside the workers, because
+    ALTER TABLE ... SET UNLOGGED/LOGGED locks the table and would block the
+    concurrent COPY streams of a split table.
+    Args:
+        target_engine (obj): Database engine.
+        tasks (list): Tables to migrate, from _get_table_tasks.
+        logged (bool): Enable or disable Postgres logging.
+        processes (int): Number of tables to alter concurrently.
+    """
+    # a partitioned table has no storage of its own, so the partitions
+    # copied into their own target tables are altered instead
+    tables = sorted(set([(x['schema'], (x.get('chunk') or {}).get('target') or x['table']) for x in tasks]))
+
+    def alter(schema, table_name):
+        con = target_engine.connect()
+        try:
+            con.execute('ALTER TABLE {}.{} SET {}'.format(_quote_ident(schema), _quote_ident(table_name),
+                                                          'LOGGED' if logged else 'UNLOGGED'))
+        except exc.DBAPIError:
+            msg = "Unable to {} logging for {}.{}".format('enable' if logged else 'disable',
+                                                          schema, table_name)
+            logging.info(msg)
+        con.close()
+
+    # SET LOGGED writes the whole table to the WAL, so run it concurrently
+    with concurrent.futures.ThreadPoolExecutor(int(processes or multiprocessing.cpu_count())) as executor:
+        list(executor.map(lambda x: alter(*x), tables))
+
+
+def _dump_json(value):
+    """
+    Serialise a key or chunk to JSON, keeping the types of Decimal, date and
+    datetime values so they can be bound to queries again.
+    Args:
+        value (obj): Value to serialise.
+    """
+    def default(x):
+        if isinstance(x, Decimal):
+            return {'__decimal__': str(x)}
+        elif isinstance(x, datetime):
+            return {'__datetime__': x.isoformat()}
+        elif isinstance(x, date):
+            return {'__date__': x.isoformat()}
+        raise TypeError('Unable to serialise {!r}'.format(x))
+
+    return json.dumps(value, default=default)
+
+
+def _load_json(value):
+    """
+    Load a key or chunk serialised by _dump_json.
+    Args:
+        value (str): JSON string, or None.
+    """
+    def object_hook(x):
+        if '__decimal__' in x:
+            return Decimal(x['__decimal__'])
+        elif '__datetime__' in x:
+            return datetime.strptime(x['__datetime__'].replace('T', ' '),
+                                     '%Y-%m-%d %H:%M:%S.%f' if '.' in x['__datetime__'] else '%Y-%m-%d %H:%M:%S')
+        elif '__date__' in x:
+            return datetime.strptime(x['__date__'], '%Y-%m-%d').date()
+        return x
+
+    if value is None:
+        return None
+    return json.loads(value, object_hook=object_hook)
+
+
+def _create_progress_table(target_engine):
+    """
+    Create the table on the target database that records the progress of
+    each table and chunk.
+    Args:
+        target_engine (obj): Database engine.
+    """
+    with target_engine.begin() as con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS {} (
+                schema_name text NOT NULL,
+                table_name text NOT NULL,
+                chunk_id text NOT NULL,
+                chunk text,
+                last_key text,
+                rows_copied bigint NOT NULL DEFAULT 0,
+                finished boolean NOT NULL DEFAULT false,
+                updated_at timestamp NOT NULL DEFAULT now(),
+                delta_start text,
+                PRIMARY KEY (schema_name, table_name, chunk_id))""".format(PROGRESS_TABLE))
+        con.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS delta_start text".format(PROGRESS_TABLE))
+
+
+def _init_progress(target_engine, tasks, delta_start=None):
+    """
+    Record every table and chunk of a new migration as not started, so a
+    resumed migration copies exactly the same chunks.
+    Args:
+        target_engine (obj): Database engine.
+        tasks (list): Tables to migrate, from _get_table_tasks.
+        delta_start (dict): SCN and time when the migration started, kept
+            so a resumed migration records the same watermarks.
+    """
+    with target_engine.begin() as con:
+        con.execute("TRUNCATE TABLE {}".format(PROGRESS_TABLE))
+        if tasks:
+            con.execute(sqlalchemy.text("""
+                INSERT INTO {} (schema_name, table_name, chunk_id, chunk, delta_start)
+                VALUES (:schema_name, :table_name, :chunk_id, :chunk, :delta_start)""".format(PROGRESS_TABLE)),
+                [{'schema_name': x['schema'], 'table_name': x['table'],
+                  'chunk_id': x['chunk']['id'] if x['chunk'] else 'table',
+                  'chunk': _dump_json(x['chunk']), 'delta_start': _dump_json(delta_start)} for x in tasks])
+
+
+def _load_delta_start(target_engine):
+    """
+    Get the SCN and time recorded when the migration being resumed started,
+    or None if nothing was recorded.
+    Args:
+        target_engine (obj): Database engine.
+    """
+    con = target_engine.connect()
+    value = con.execute("""
+        SELECT delta_start
+        FROM {}
+        WHERE delta_start IS NOT NULL
+        LIMIT 1""".format(PROGRESS_TABLE)).scalar()
+    con.close()
+
+    return _load_json(value)
+
+
+def _save_progress(target_cursor, source_schema, table_name, chunk, last_key, rows_copied,
+                   finished=False):
+    """
+    Record the progress of a table or chunk. Called in the same transaction
+    as the COPY of each batch, so the recorded key always matches the rows
+    committed on the target.
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        source_schema (str): Name of the schema.
+        table_name (str): Name of the table.
+        chunk (dict): Chunk being copied, or None for the whole table.
+        last_key (dict): Key of the last row copied.
+        rows_copied (int): Number of rows copied so far.
+        finished (bool): The table or chunk has been copied.
+    """
+    target_cursor.execute("""
+        INSERT INTO {} (schema_name, table_name, chunk_id, chunk, last_key, rows_copied, finished)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (schema_name, table_name, chunk_id) DO UPDATE
+        SET last_key = EXCLUDED.last_key,
+            rows_copied = EXCLUDED.rows_copied,
+            finished = EXCLUDED.finished,
+            updated_at = now()""".format(PROGRESS_TABLE),
+        [source_schema, table_name, chunk['id'] if chunk else 'table', _dump_json(chunk),
+         _dump_json(last_key) if last_key else None, rows_copied, finished])
+
+
+def _resume_tasks(target_engine, tasks):
+    """
+    Restrict the tasks of a migration to the tables and chunks that were
+    not finished by an earlier run. Tables recorded by the earlier run keep
+    the chunks recorded for them, with the progress of each chunk attached
+    to its task, even if the table would be split differently now. Tables
+    that were not recorded are migrated in full.
+    Args:
+        target_engine (obj): Database engine.
+        tasks (list): Tables to migrate, from _get_table_tasks.
+    """
+    con = target_engine.connect()
+    rows = con.execute("""
+        SELECT schema_name, table_name, chunk_id, chunk, last_key, rows_copied, finished
+        FROM {}""".format(PROGRESS_TABLE)).fetchall()
+    con.close()
+
+    progress = {}
+    for row in rows:
+        progress.setdefault((row[0], row[1]), []).append({'chunk_id': row[2],
+                                                          'chunk': _load_json(row[3]),
+                                                          'last_key': _load_json(row[4]),
+                                                          'rows_copied': row[5],
+                                                          'finished': row[6]})
+
+    # the tasks of each table
+    tables = {}
+    for task in tasks:
+        tables.setdefault((task['schema'], task['table']), []).append(task)
+
+    resumed = []
+    skipped = 0
+    for key, table_tasks in tables.items():
+        if key not in progress:
+            resumed.extend(table_tasks)
+            continue
+
+        # the recorded chunks replace the chunks of this run, sized from
+        # the matching task or else by their share of the table
+        chunk_tasks = {x['chunk']['id'] if x['chunk'] else 'table': x for x in table_tasks}
+        chunk_size = sum([x['size'] for x in table_tasks]) // len(progress[key])
+        for row in progress[key]:
+            if row['finished']:
+                skipped = skipped + 1
+                continue
+            task = chunk_tasks.get(row['chunk_id'], dict(table_tasks[0], size=chunk_size))
+            resumed.append(dict(task, chunk=row['chunk'], progress=row))
+
+    resumed.sort(key=lambda x: x['size'], reverse=True)
+
+    msg = '\tResuming migration: {} tables and chunks already finished'.format(skipped)
+    logging.info(msg)
+
+    return resumed
+
+
+def _get_delta_start(source_engine):
+    """
+    Get the current SCN and time on the source database, recorded as the
+    high-water mark of each table when the migration starts. Rows changed
+    while the migration runs are picked up again by the next delta load.
+    Args:
+        source_engine (obj): Database engine.
+    """
+    con = source_engine.connect()
+    start = {'timestamp': con.execute("SELECT CAST(SYSTIMESTAMP AS TIMESTAMP) FROM dual").scalar()}
+    try:
+        start['scn'] = int(con.execute("SELECT current_scn FROM v$database").scalar())
+    except exc.DBAPIError:
+        start['scn'] = int(con.execute("SELECT TIMESTAMP_TO_SCN(SYSTIMESTAMP) FROM dual").scalar())
+    con.close()
+
+    return start
+
+
+def _create_watermark_table(target_engine):
+    """
+    Create the table on the target database that records the high-water
+    mark of each table for delta loads.
+    Args:
+        target_engine (obj): Database engine.
+    """
+    with target_engine.begin() as con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS {} (
+                schema_name text NOT NULL,
+                table_name text NOT NULL,
+                delta_column text,
+                watermark text NOT NULL,
+                updated_at timestamp NOT NULL DEFAULT now(),
+                PRIMARY KEY (schema_name, table_name))""".format(WATERMARK_TABLE))
+
+
+def _get_deltas(target_engine, tasks, migration_config):
+    """
+    Work out how each table is extracted by a delta load. A table with a
+    recorded high-water mark and a primary key is extracted from its
+    watermark, using ORA_ROWSCN or the column set in
+    migration_config['delta_columns'] = {'schema.table': column}. Any other
+    table is reloaded in full. Returns a dict keyed by (schema, table).
+    Args:
+        target_engine (obj): Database engine.
+        tasks (list): Tables to migrate, from _get_table_tasks.
+        migration_config (dict): Settings for the migration.
+    """
+    con = target_engine.connect()
+    rows = con.execute("""
+        SELECT schema_name, table_name, delta_column, watermark
+        FROM {}""".format(WATERMARK_TABLE)).fetchall()
+    con.close()
+    watermarks = {(x[0], x[1]): (x[2], _load_json(x[3])) for x in rows}
+
+    delta_columns = migration_config.get('delta_columns') or {}
+    deltas = {}
+    for task in tasks:
+        key = (task['schema'], task['table'])
+        if key in deltas:
+            continue
+
+        column = delta_columns.get('{}.{}'.format(*key))
+        t = _get_cached_table(task['metadata'], None, *key)
+        watermark = watermarks.get(key)
+
+        if not t.primary_key.columns:
+            msg = "\t{}.{}: No primary key to merge changes, reloading table".format(*key)
+            logging.info(msg)
+            deltas[key] = {'column': column, 'watermark': None}
+        elif watermark is None or watermark[0] != column:
+            msg = "\t{}.{}: No watermark for delta load, reloading table".format(*key)
+            logging.info(msg)
+            deltas[key] = {'column': column, 'watermark': None}
+        else:
+            deltas[key] = {'column': column, 'watermark': watermark[1]}
+
+    return deltas
+
+
+def _delta_predicate(delta):
+    """
+    Build the predicate and bind values that restrict a query to the rows
+    changed since the watermark. ORA_ROWSCN is tracked per block unless the
+    table was created with ROWDEPENDENCIES, so it may return unchanged rows
+    too, which the merge applies harmlessly.
+    Args:
+        delta (dict): Delta settings for the table, from _get_deltas.
+    """
+    if delta['column']:
+        return '{} >= :wm'.format(_quote_column(delta['column'])), {'wm': delta['watermark']}
+
+    return 'ORA_ROWSCN > :wm', {'wm': delta['watermark']}
+
+
+def _save_watermarks(target_engine, tasks, migration_config, delta_start):
+    """
+    Record the high-water mark of each migrated table.
+    Args:
+        target_engine (obj): Database engine.
+        tasks (list): Tables migrated, from _get_table_tasks.
+        migration_config (dict): Settings for the migration.
+        delta_start (dict): SCN and time when the migration started.
+    """
+    delta_columns = migration_config.get('delta_columns') or {}
+    tables = sorted(set([(x['schema'], x['table']) for x in tasks]))
+
+    with target_engine.begin() as con:
+        for schema, table_name in tables:
+            column = delta_columns.get('{}.{}'.format(schema, table_name))
+            watermark = delta_start['timestamp'] if column else delta_start['scn']
+            con.execute(sqlalchemy.text("""
+                INSERT INTO {} (schema_name, table_name, delta_column, watermark)
+                VALUES (:schema_name, :table_name, :delta_column, :watermark)
+                ON CONFLICT (schema_name, table_name) DO UPDATE
+                SET delta_column = EXCLUDED.delta_column,
+                    watermark = EXCLUDED.watermark,
+                    updated_at = now()""".format(WATERMARK_TABLE)),
+                {'schema_name': schema, 'table_name': table_name, 'delta_column': column,
+                 'watermark': _dump_json(watermark)})
+
+
+def _truncate_tables(target_engine, tables):
+    """
+    Empty tables on the target database before they are reloaded. The
+    tables are truncated in one statement, so foreign keys between them do
+    not block it. CASCADE is not used, as it would also empty tables that
+    are not being reloaded, so a foreign key from any other table still
+    raises an error.
+    Args:
+        target_engine (obj): Database engine.
+        tables (list): (schema, table) pairs.
+    """
+    if not tables:
+        return
+
+    with target_engine.begin() as con:
+        con.execute('TRUNCATE TABLE {}'.format(', '.join(['{}.{}'.format(_quote_ident(schema),
+                                                                         _quote_ident(table_name))
+                                                          for schema, table_name in tables])))
+
+
+# upper bounds in seconds of the batch latency histogram buckets
+METRICS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# metrics of the current migration, by table, kept in the main process
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+# queue used by worker processes to send metrics to the main process
+_metrics_queue = None
+
+# event set in worker processes when the migration is cancelled
+_cancel_event = None
+
+
+def _record_metrics(schema, table_name, event, **values):
+    """
+    Record a metrics event for a table. Worker processes send the event to
+    the main process, which keeps the totals.
+    Args:
+        schema (str): Name of the schema.
+        table_name (str): Name of the table.
+        event (str): 'queued', 'started', 'batch', 'lobs' or 'finished'.
+        values (dict): Values of the event, e.g. rows and bytes of a batch.
+    """
+    item = (schema, table_name, event, os.getpid(), time.time(), values)
+    if _metrics_queue is not None:
+        _metrics_queue.put(item)
+    else:
+        _update_metrics(item)
+
+
+def _update_metrics(item):
+    """
+    Add a metrics event to the totals for its table and worker.
+    Args:
+        item (tuple): Schema, table name, event, worker pid, time and values.
+    """
+    schema, table_name, event, pid, timestamp, values = item
+    with _metrics_lock:
+        tables = _metrics.setdefault('tables', {})
+        m = tables.setdefault('{}.{}'.format(schema, table_name), {
+            'schema': schema, 'table': table_name, 'tasks': 0, 'running': 0, 'finished': 0, 'failed': 0,
+            'expected_rows': 0, 'rows': 0, 'bytes': 0, 'batches': 0, 'fetch_seconds': 0.0,
+            'insert_seconds': 0.0, 'wait_seconds': 0.0, 'batch_seconds': 0.0,
+            'latency_buckets': [0] * len(METRICS_BUCKETS), 'started': None, 'last_batch': None,
+            'ended': None, 'workers': []})
+        if event == 'queued':
+            m['tasks'] = m['tasks'] + 1
+            m['expected_rows'] = m['expected_rows'] + (values.get('expected_rows') or 0)
+        elif event == 'started':
+            m['running'] = m['running'] + 1
+            m['started'] = m['started'] or timestamp
+            if pid not in m['workers']:
+                m['workers'].append(pid)
+        elif event == 'finished':
+            m['running'] = m['running'] - 1
+            m['finished'] = m['finished'] + 1
+            if values.get('failed'):
+                m['failed'] = m['failed'] + 1
+            m['ended'] = timestamp
+        elif event == 'lobs':
+            for key, value in values.items():
+                m[key] = max(m.get(key, 0), value) if key == 'lob_largest' else m.get(key, 0) + value
+        elif event == 'batch':
+            for key in ('rows', 'bytes', 'fetch_seconds', 'insert_seconds', 'wait_seconds', 'batch_seconds'):
+                m[key] = m[key] + values[key]
+            m['batches'] = m['batches'] + 1
+            m['last_batch'] = timestamp
+            for i, bound in enumerate(METRICS_BUCKETS):
+                if values['batch_seconds'] <= bound:
+                    m['latency_buckets'][i] = m['latency_buckets'][i] + 1
+
+            workers = _metrics.setdefault('workers', {})
+            w = workers.setdefault(pid, {'rows': 0, 'bytes': 0, 'batches': 0, 'last_batch': None, 'table': None})
+            w['rows'] = w['rows'] + values['rows']
+            w['bytes'] = w['bytes'] + values['bytes']
+            w['batches'] = w['batches'] + 1
+            w['last_batch'] = timestamp
+            w['table'] = '{}.{}'.format(schema, table_name)
+
+
+def _collect_metrics(metrics_queue):
+    """
+    Add the metrics events sent by the worker processes to the totals,
+    until None is received.
+    Args:
+        metrics_queue (obj): Queue the workers send metrics on.
+    """
+    while True:
+        item = metrics_queue.get()
+        if item is None:
+            break
+        _update_metrics(item)
+
+
+def _reset_metrics():
+    """
+    Clear the metrics at the start of a migration.
+    """
+    with _metrics_lock:
+        _metrics.clear()
+        _metrics.update({'started': time.time(), 'ended': None, 'tables': {}, 'workers': {}})
+
+
+def get_metrics():
+    """
+    Get a copy of the metrics of the current or last migration in this
+    process, with the rate and estimated time remaining for each table.
+    """
+    now = time.time()
+    with _metrics_lock:
+        metrics = json.loads(json.dumps(_metrics))
+
+    for m in metrics.get('tables', {}).values():
+        elapsed = ((m['ended'] if not m['running'] and m['ended'] else now) - m['started']) if m['started'] else 0
+        m['rows_per_second'] = m['rows'] / elapsed if elapsed else 0
+        m['bytes_per_second'] = m['bytes'] / elapsed if elapsed else 0
+        remaining = max(m['expected_rows'] - m['rows'], 0)
+        if m['finished'] == m['tasks']:
+            m['eta_seconds'] = 0
+        elif m['rows_per_second']:
+            m['eta_seconds'] = remaining / m['rows_per_second']
+        else:
+            m['eta_seconds'] = None
+
+    if metrics.get('started'):
+        tables = metrics['tables'].values()
+        elapsed = (metrics['ended'] or now) - metrics['started']
+        rows = sum([x['rows'] for x in tables])
+        remaining = sum([max(x['expected_rows'] - x['rows'], 0) for x in tables if x['finished'] < x['tasks']])
+        metrics['rows'] = rows
+        metrics['bytes'] = sum([x['bytes'] for x in tables])
+        metrics['elapsed_seconds'] = elapsed
+        metrics['rows_per_second'] = rows / elapsed if elapsed else 0
+        metrics['eta_seconds'] = remaining / metrics['rows_per_second'] if metrics['rows_per_second'] else None
+
+    return metrics
+
+
+def _format_labels(labels):
+    """
+    Format Prometheus labels, e.g. {schema="hr",table="jobs"}.
+    Args:
+        labels (list): (name, value) pairs.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                           for k, v in labels]) + '}'
+
+
+def format_metrics():
+    """
+    Format the metrics of the current or last migration in the Prometheus
+    text exposition format.
+    """
+    metrics = get_metrics()
+    lines = []
+
+    def add(name, kind, help_text, samples):
+        lines.append('# HELP oracle2postgres_{} {}'.format(name, help_text))
+        lines.append('# TYPE oracle2postgres_{} {}'.format(name, kind))
+        for suffix, labels, value in samples:
+            lines.append('oracle2postgres_{}{}{} {}'.format(name, suffix, _format_labels(labels),
+                                                            'NaN' if value is None else value))
+
+    tables = sorted(metrics.get('tables', {}).values(), key=lambda x: (x['schema'], x['table']))
+    labels = [[('schema', x['schema']), ('table', x['table'])] for x in tables]
+
+    for name, key, kind, help_text in [
+            ('rows_total', 'rows', 'counter', 'Rows copied.'),
+            ('bytes_total', 'bytes', 'counter', 'Bytes sent to the target with COPY.'),
+            ('batches_total', 'batches', 'counter', 'Batches copied.'),
+            ('fetch_seconds_total', 'fetch_seconds', 'counter', 'Time spent fetching from the source.'),
+            ('insert_seconds_total', 'insert_seconds', 'counter', 'Time spent loading into the target.'),
+            ('queue_wait_seconds_total', 'wait_seconds', 'counter', 'Time spent waiting for the next batch.'),
+            ('expected_rows', 'expected_rows', 'gauge', 'Estimated rows to copy.'),
+            ('rows_per_second', 'rows_per_second', 'gauge', 'Rows copied per second.'),
+            ('eta_seconds', 'eta_seconds', 'gauge', 'Estimated seconds until the table is copied.'),
+            ('running_tasks', 'running', 'gauge', 'Tables or chunks being copied.'),
+            ('failed_tasks_total', 'failed', 'counter', 'Tables or chunks that failed.'),
+            ('last_batch_timestamp_seconds', 'last_batch', 'gauge', 'Time the last batch was copied.')]:
+        add(name, kind, help_text, [('', x, t[key]) for x, t in zip(labels, tables)])
+
+    samples = []
+    for x, t in zip(labels, tables):
+        for bound, count in zip(METRICS_BUCKETS, t['latency_buckets']):
+            samples.append(('_bucket', x + [('le', bound)], count))
+        samples.append(('_bucket', x + [('le', '+Inf')], t['batches']))
+        samples.append(('_sum', x, t['batch_seconds']))
+        samples.append(('_count', x, t['batches']))
+    add('batch_seconds', 'histogram', 'Time to read and load a batch.', samples)
+
+    workers = sorted(metrics.get('workers', {}).items())
+    add('worker_rows_total', 'counter', 'Rows copied by each worker process.',
+        [('', [('worker', pid)], w['rows']) for pid, w in workers])
+    add('worker_last_batch_timestamp_seconds', 'gauge', 'Time each worker process last copied a batch.',
+        [('', [('worker', pid)], w['last_batch']) for pid, w in workers])
+
+    if metrics.get('started'):
+        add('migration_eta_seconds', 'gauge', 'Estimated seconds until the migration completes.',
+            [('', [], metrics['eta_seconds'])])
+
+    return '\n'.join(lines) + '\n'
+
+
+def _write_report(path):
+    """
+    Write the metrics of the migration to a JSON file.
+    Args:
+        path (str): Path of the report.
+    """
+    report = get_metrics()
+    for key in ('started', 'ended'):
+        if report.get(key):
+            report[key] = datetime.fromtimestamp(report[key]).isoformat()
+    for m in report.get('tables', {}).values():
+        m['latency_buckets'] = dict(zip([str(x) for x in METRICS_BUCKETS], m['latency_buckets']))
+        for key in ('started', 'last_batch', 'ended'):
+            if m.get(key):
+                m[key] = datetime.fromtimestamp(m[key]).isoformat()
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    msg = '\tMigration report written to {}'.format(path)
+    logging.info(msg)
+
+
+def _migrate_table(task, source_config, target_config, migration_config):
+    """
+    Migrate the data from a source table to the target table
+    Args:
+        task (dict): Schema, table name, metadata cache path, size, row
+            size, chunk, progress and delta settings of the table to migrate.
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+    """
+    # tables or chunks not yet started are skipped once cancelled
+    if _cancel_event is not None and _cancel_event.is_set():
+        msg = '\t{}.{}: Skipped, migration cancelled'.format(task['schema'], task['table'])
+        logging.info(msg)
+        return
+
+    source_engine = connect_to_source(source_config)
+    target_engine = connect_to_target(target_config, target_config['database'])
+
+    # load the table metadata profile
+    t = _get_cached_table(task['metadata'], source_engine, task['schema'], task['table'])
+
+    # a failed copy is recorded as finished too, so the metrics settle
+    _record_metrics(task['schema'], task['table'], 'started')
+    failed = True
+    try:
+        _copy_data(source_engine, task['schema'], target_engine, t, migration_config['batchsize'],
+                   trialrun=migration_config['trialrun'],
+                   copy_format=migration_config.get('copy_format', 'text'),
+                   chunk=task.get('chunk'), queue_depth=int(migration_config.get('queue_depth', 2)),
+                   null_columns=(migration_config.get('null_columns') or {}).get('{}.{}'.format(task['schema'],
+                                                                                                task['table'])),
+                   nul_replacement=migration_config.get('nul_replacement', ''),
+                   checkpoint=migration_config.get('checkpoint', True), progress=task.get('progress'),
+                   delta=task.get('delta'), batch_bytes=migration_config.get('batch_bytes', 0),
+                   memory_limit=migration_config.get('batch_memory', 256 * 1024 * 1024),
+                   row_bytes=task.get('row_bytes'), fetch_as_text=migration_config.get('fetch_as_text', False),
+                   lob_inline_size=migration_config.get('lob_inline_size', 32768))
+        failed = False
+    finally:
+        _record_metrics(task['schema'], task['table'], 'finished', failed=failed)
+
+
+def create_target_schema(schema_list, source_engine, target_engine, profile=False, metadata_paths=None):
+    """
+    Recreate the sources tables on the target database
+    Args:
+        schema_list (list): List of schema.
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        profile (bool): Scan NUMBER columns declared without a precision,
+            to narrow them to integer or NUMERIC(p,s) types from the data.
+        metadata_paths (dict): Schema metadata files to use instead of
+            reflecting the source, keyed by schema, e.g. from the manifest
+            of staged files. The source engine is then not used.
+    """
+    msg = 'Creating schema on target database...\n'
+    print(msg)
+    for source_schema in schema_list:
+
+        # load the schema metadata profile
+        print(source_schema)
+        if metadata_paths:
+            source_metadata = _load_metadata(metadata_paths[source_schema])
+        else:
+            source_metadata = _reflect_schema(source_engine, source_schema)
+
+        # create the schema on the target database
+        target_engine.execute(sqlalchemy.schema.CreateSchema(source_schema))
+        partition_statements = []
+
+        # iterate the tables
+        for t in source_metadata.sorted_tables:
+
+            # clear the indexes and constraints, which are created after the
+            # load. The primary key is kept apart from the other constraints.
+            # Integer key columns would otherwise be created as serial.
+            t.indexes.clear()
+            t.constraints.clear()
+            t.primary_key = sqlalchemy.PrimaryKeyConstraint()
+            for col in t.columns:
+                col.autoincrement = False
+
+            # recreate the partitioning of partitioned tables
+            partition_ddl = _get_partition_ddl(source_schema, t)
+            if partition_ddl:
+                t.dialect_options['postgresql']['partition_by'] = partition_ddl[0]
+                partition_statements.extend(partition_ddl[1])
+                if t.info['partitioning']['subpartitioning'] not in (None, 'NONE'):
+                    msg = "\t{}.{}: Subpartitions not recreated".format(source_schema, t.name)
+                    logging.info(msg)
+            elif t.info.get('partitioning'):
+                msg = "\t{}.{}: {} partitioning not recreated".format(source_schema, t.name,
+                                                                       t.info['partitioning']['type'])
+                logging.warning(msg)
+
+            number_profile = {}
+            if profile and not metadata_paths:
+                number_profile = _profile_numbers(source_engine, source_schema, t)
+
+            # clean the data types
+            for col in t.columns:
+
+                # set the column types
+                newtype = _convert_type(col.name, col.type,
+                                        schema_name=source_schema, table_name=t.name,
+                                        profile=number_profile.get(col.name))
+                t.c[col.name].type = newtype
+
+                # check the default values
+                if t.c[col.name].default:
+                    new_default = _check_default(t.c[col.name].default)
+                    t.c[col.name].default = new_default
+
+                # remove the server_default values
+                if t.c[col.name].server_default:
+                    t.c[col.name].server_default = None
+
+                    # Build the tables on the target database
+        source_metadata.create_all(target_engine, checkfirst=False)
+        for statement in partition_statements:
+            target_engine.execute(statement)
+
+        msg = "\t{}: Target schema created: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"),
+                                                     source_schema)
+        logging.info(msg)
+
+
+def create_constraints(schema_list, source_engine, target_engine, migration_config, metadata_paths=None):
+    """
+    Recreate the primary keys, unique constraints, indexes and foreign keys
+    of the source tables on the target database, after the data is loaded.
+    Tables are processed concurrently. Foreign keys are added NOT VALID and
+    then validated, so they do not block each other while being checked.
+    Args:
+        schema_list (list): List of schema.
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        migration_config (dict): Settings for the migration. Uses
+            'processes', 'maintenance_work_mem' and
+            'max_parallel_maintenance_workers'.
+        metadata_paths (dict): Schema metadata files to use instead of
+            reflecting the source, keyed by schema.
+    """
+    msg = '\tCreating constraints and indexes on target database...\n'
+    print(msg)
+    logging.info(msg)
+
+    dialect = sqlalchemy.dialects.postgresql.dialect()
+    table_ddl = {}
+    foreign_keys = {}
+
+    for source_schema in schema_list:
+        if metadata_paths:
+            source_metadata = _load_metadata(metadata_paths[source_schema])
+        else:
+            source_metadata = _reflect_schema(source_engine, source_schema)
+
+        for t in source_metadata.sorted_tables:
+            statements = []
+            constraint_columns = []
+
+            partition_columns = []
+            if _get_partition_ddl(source_schema, t):
+                partition_columns = t.info['partitioning']['columns']
+
+            # primary keys and unique constraints first, as foreign keys need them
+            for constraint in t.constraints:
+                if isinstance(constraint, (sqlalchemy.PrimaryKeyConstraint, sqlalchemy.UniqueConstraint)) \
+                        and constraint.columns:
+                    columns = [x.name for x in constraint.columns]
+                    if set(partition_columns) - set(columns):
+                        # a partitioned table can only have keys that include
+                        # the partition key, so the columns are indexed instead
+                        msg = "\t{}.{}: {} does not include the partition key, creating an index".format(
+                            source_schema, t.name, constraint.name or 'Primary key')
+                        logging.warning(msg)
+                        index = sqlalchemy.Index(constraint.name, *constraint.columns)
+                        statements.append(str(sqlalchemy.schema.CreateIndex(index).compile(dialect=dialect)))
+                    else:
+                        statements.append(str(sqlalchemy.schema.AddConstraint(constraint).compile(dialect=dialect)))
+                    constraint_columns.append(columns)
+
+            # secondary indexes, skipping those that back a constraint and
+            # function based indexes, which are not reflected
+            for index in t.indexes:
+                columns = [x.name for x in index.columns]
+                if columns and columns not in constraint_columns:
+                    statements.append(str(sqlalchemy.schema.CreateIndex(index).compile(dialect=dialect)))
+
+            if statements:
+                table_ddl[(source_schema, t.name)] = statements
+
+            fk_statements = []
+            for constraint in t.foreign_key_constraints:
+                fk_statements.append((str(sqlalchemy.schema.AddConstraint(constraint).compile(dialect=dialect)),
+                                      'ALTER TABLE {}.{} VALIDATE CONSTRAINT {}'.format(
+                                          _quote_ident(source_schema), _quote_ident(t.name),
+                                          _quote_ident(constraint.name))))
+            if fk_statements:
+                foreign_keys[(source_schema, t.name)] = fk_statements
+
+    settings = ["SET maintenance_work_mem = '{}'".format(migration_config.get('maintenance_work_mem', '1GB'))]
+    if migration_config.get('max_parallel_maintenance_workers') is not None:
+        settings.append('SET max_parallel_maintenance_workers = {}'.format(
+            int(migration_config['max_parallel_maintenance_workers'])))
+
+    processes = int(migration_config.get('processes') or multiprocessing.cpu_count())
+
+    # build the keys and indexes of different tables concurrently
+    _run_ddl(target_engine, list(table_ddl.values()), settings, processes)
+
+    # adding a NOT VALID foreign key only updates the catalog, so is fast,
+    # but it locks both tables, so these are added one at a time
+    _run_ddl(target_engine, [[x[0] + ' NOT VALID' for x in fks] for fks in foreign_keys.values()],
+             settings, 1)
+
+    # validate the foreign keys of different tables concurrently
+    _run_ddl(target_engine, [[x[1] for x in fks] for fks in foreign_keys.values()], settings, processes)
+
+    msg = "\t{}: Constraints and indexes created".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"))
+    logging.info(msg)
+
+
+def _run_ddl(target_engine, statement_groups, settings, processes):
+    """
+    Run groups of DDL statements concurrently. The statements in a group
+    are run in order on one connection. Failed statements are logged and
+    skipped.
+    Args:
+        target_engine (obj): Database engine.
+        statement_groups (list): Lists of statements.
+        settings (list): Statements run first on each connection.
+        processes (int): Number of groups to run concurrently.
+    """
+    def run(statements):
+        # each statement commits on its own, so the settings are not lost
+        # when a failed statement rolls back its transaction
+        con = target_engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        for setting in settings:
+            con.execute(setting)
+        for statement in statements:
+            try:
+                con.execute(statement)
+                msg = "\t{}: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), statement)
+                logging.info(msg)
+            except exc.DBAPIError as e:
+                msg = "\tUnable to run {}: {}".format(statement, e)
+                logging.error(msg)
+        con.execute('RESET ALL')
+        con.close()
+
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        list(executor.map(run, statement_groups))
+
+
+def drop_connections(dbname, engine):
+    """
+    Closes connections to a database to avoid any interference
+    with the migration.
+    Args:
+        dbname (str): Name of database.
+        engine (obj): Database engine.
+    """
+    con = engine.connect()
+    con.execute("COMMIT")  # need to close current transaction
+    con.execute("""
+        SELECT pg_terminate_backend(pid) 
+        FROM pg_stat_activity 
+        WHERE datname = '{}';""".format(dbname))
+    con.execute("COMMIT")  # need to close current transaction
+    con.close()
+
+
+def drop_database(dbname, engine):
+    """
+    Warning, drops the specified database!
+    Args:
+        dbname (str): Name of database to drop.
+        engine (obj): Database engine.
+    """
+
+    # msg =  """
+    # --------------------------------------------------------- \n
+    # Warning, you are about to delete the following database!  \n
+    # {}.{}
+    # Are you sure you wish to continue?                        \n
+    # Type 'yes' to proceed.                                    \n
+    # --------------------------------------------------------- \n
+    # \n""".format(engine.name,dbname)
+    #
+    # if input(msg).lower() != "yes":
+    #     sys.exit()
+
+    con = engine.connect()
+    con.execute("COMMIT")  # need to close current transaction
+    con.execute("DROP DATABASE IF EXISTS {}".format(dbname))
+    con.execute("COMMIT")  # need to close current transaction
+    con.close()
+    msg = "\t{}: Target database dropped: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), dbname)
+    logging.info(msg)
+
+
+def create_database(dbname, engine):
+    """
+    Creates a new database on the target.
+    Args:
+        dbname (str): Name of database.
+        engine (obj): Database engine.
+    """
+    con = engine.connect()
+    con.execute("COMMIT")  # need to close current transaction
+    con.execute("CREATE DATABASE {}".format(dbname))
+    con.execute("COMMIT")
+    con.close()
+    msg = "\t{}: Target database created: {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), dbname)
+    logging.info(msg)
+
+
+def _check_default(default):
+    new_default = default
+    logging.info("CHECKING DEFAULT")
+
+    if str(default).lower() == "sysdate":
+        logging.info("UPDATED")
+        new_default = None
+
+    return new_default
+
+
+def _insert_data(target_cursor, source_schema, table, data, column_types, copy_format='text',
+                 target_table=None, null_indexes=None, nul_replacement=''):
+    """
+    Streams the data into the target system with COPY ... FROM STDIN.
+    Integrity checks are disabled for the session by _copy_data. Returns
+    the number of bytes sent to the target.
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+        data (list): Rows to insert, as sequences in column order.
+        column_types (dict): Target type name for each column.
+        copy_format (str): COPY format, either 'text' or 'binary'.
+        target_table (str): Quoted name of the table to load, if not the
+            table of the same name on the target.
+        null_indexes (list): Positions of the columns containing null
+            characters, which are replaced in LOBs as they are streamed.
+        nul_replacement (str): String that replaces null characters.
+    """
+    if not data:
+        return 0
+
+    column_keys = table.columns.keys()
+    if not target_table:
+        target_table = '{}.{}'.format(_quote_ident(source_schema), _quote_ident(table.name))
+    query = "COPY {} ({}) FROM STDIN WITH (FORMAT {})".format(
+        target_table, ', '.join([_quote_ident(x) for x in column_keys]), copy_format)
+
+    if copy_format == 'binary':
+        encoders = _get_binary_encoders(column_keys, column_types, null_indexes, nul_replacement)
+        stream = _CopyStream(_copy_binary_rows(data, encoders))
+    else:
+        lob_indexes = [i for i, x in enumerate(table.columns) if _is_lob(x.type)]
+        stream = _CopyStream(_copy_text_rows(data, lob_indexes, null_indexes, nul_replacement))
+
+    target_cursor.copy_expert(query, stream, size=COPY_BUFFER_SIZE)
+    return stream.bytes_read
+
+
+def _create_stage(target_cursor, source_schema, table):
+    """
+    Create a temporary table to stage changed rows before they are merged
+    into the target table. Returns the name of the staging table.
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+    """
+    stage = 'pg_temp.{}'.format(_quote_ident('o2p_stage_{}'.format(table.name)))
+    target_cursor.execute('DROP TABLE IF EXISTS {}'.format(stage))
+    target_cursor.execute('CREATE TEMP TABLE {} (LIKE {}.{})'.format(stage, _quote_ident(source_schema),
+                                                                    _quote_ident(table.name)))
+    return stage
+
+
+def _merge_stage(target_cursor, source_schema, table, stage):
+    """
+    Merge the staged rows into the target table, replacing rows with the
+    same primary key, then empty the staging table. This does not need a
+    primary key constraint on the target table.
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+        stage (str): Name of the staging table.
+    """
+    target_table = '{}.{}'.format(_quote_ident(source_schema), _quote_ident(table.name))
+    key_str = ' AND '.join(['t.{0} = s.{0}'.format(_quote_ident(x.name)) for x in table.primary_key.columns])
+    column_str = ', '.join([_quote_ident(x) for x in table.columns.keys()])
+
+    target_cursor.execute('DELETE FROM {} t USING {} s WHERE {}'.format(target_table, stage, key_str))
+    target_cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2}'.format(target_table, column_str, stage))
+    target_cursor.execute('TRUNCATE TABLE {}'.format(stage))
+
+
+def _quote_ident(name):
+    """
+    Quote an identifier for use in a target query.
+    Args:
+        name (str): Name of the schema, table or column.
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _get_target_types(target_cursor, source_schema, table):
+    """
+    Look up the type of each column of a table on the target database.
+    Returns a dict of column name to type name, e.g. 'numeric' or
+    'timestamp without time zone'.
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+    """
+    target_cursor.execute("""
+        SELECT attname, format_type(atttypid, NULL)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass
+        AND attnum > 0
+        AND NOT attisdropped""", ['{}.{}'.format(_quote_ident(source_schema), _quote_ident(table.name))])
+
+    return dict(target_cursor.fetchall())
+
+
+def _get_converted_types(source_schema, table):
+    """
+    Get the target type name of each column, as _get_target_types reads
+    them from Postgres, from the type mapping of the migration. Used where
+    the target database is not available to look them up.
+    Args:
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object, reflected from the source.
+    """
+    dialect = sqlalchemy.dialects.postgresql.dialect()
+    aliases = {'varchar': 'character varying', 'char': 'character', 'timestamp': 'timestamp without time zone'}
+    column_types = {}
+    for col in table.columns:
+        pg_type = _convert_type(col.name, col.type, schema_name=source_schema, table_name=table.name)
+        type_name = ' '.join(re.sub(r'\(.*?\)', '', pg_type.compile(dialect=dialect).lower()).split())
+        if type_name.startswith('interval'):
+            type_name = 'interval'
+        column_types[col.name] = aliases.get(type_name, type_name)
+
+    return column_types
+
+
+class _CopyStream(io.RawIOBase):
+    """
+    Read-only file object that feeds COPY from an iterator of byte strings,
+    so a batch never has to be held in memory as one large buffer.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b'')
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = 0
+        while size < len(b):
+            if not self._buffer:
+                try:
+                    # a memoryview is sliced without copying the rest of a large chunk
+                    self._buffer = memoryview(next(self._chunks))
+                except StopIteration:
+                    break
+            n = min(len(b) - size, len(self._buffer))
+            b[size:size + n] = self._buffer[:n]
+            self._buffer = self._buffer[n:]
+            size = size + n
+        self.bytes_read = self.bytes_read + size
+        return size
+
+
+def _escape_copy_text(value):
+    """
+    Add the backslash escapes required by the COPY text format. Each
+    str.replace scans the string in C, which is many times faster than
+    str.translate with a mapping.
+    Args:
+        value (str): String to escape.
+    """
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_text_value(value):
+    """
+    Serialise a source value for the COPY text format.
+    Args:
+        value (obj): Value fetched from the source database.
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, str):
+        return _escape_copy_text(value)
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (int, Decimal)):
+        return str(value)
+    elif isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        elif math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(value)
+    elif isinstance(value, datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, timedelta):
+        return '{} days {} seconds {} microseconds'.format(value.days, value.seconds,
+                                                           value.microseconds)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea hex format, with the backslash escaped for COPY
+        return '\\\\x' + bytes(value).hex()
+    elif hasattr(value, 'read'):
+        # LOB locator
+        return _copy_text_value(value.read())
+
+    return _escape_copy_text(str(value))
+
+
+def _read_lob(lob, nul_replacement=None):
+    """
+    Generator that reads a LOB in pieces of LOB_READ_SIZE characters or
+    bytes, so a large LOB is never held in memory whole.
+    Args:
+        lob (obj): cx_Oracle LOB locator.
+        nul_replacement (str): If set, null characters in each piece of a
+            CLOB are replaced with this string.
+    """
+    # offsets count UTF-16 code units in CLOBs, which are not always
+    # Python characters, so step through the size reported by Oracle
+    for offset in range(1, lob.size() + 1, LOB_READ_SIZE):
+        piece = lob.read(offset, LOB_READ_SIZE)
+        if nul_replacement is not None and isinstance(piece, str):
+            piece = piece.replace(chr(0), nul_replacement)
+        yield piece
+
+
+def _copy_text_lob_row(row, lob_indexes, null_indexes=(), nul_replacement=''):
+    """
+    Generate the COPY text format for a row holding LOB locators, streaming
+    each LOB in pieces.
+    Args:
+        row (list): Row to insert.
+        lob_indexes (list): Positions of the LOB columns.
+        null_indexes (list): Positions of the columns containing null
+            characters, which are replaced piece by piece.
+        nul_replacement (str): String that replaces null characters.
+    """
+    line = []
+    for i, value in enumerate(row):
+        if i in lob_indexes and hasattr(value, 'read'):
+            yield ('\t'.join(line) + ('\t' if line else '')).encode('utf-8')
+            line = []
+            hex_prefix = b'\\\\x'
+            for piece in _read_lob(value, nul_replacement if i in null_indexes else None):
+                if isinstance(piece, str):
+                    yield _escape_copy_text(piece).encode('utf-8')
+                else:
+                    # bytea hex format, with the prefix before the first piece
+                    yield hex_prefix + piece.hex().encode('ascii')
+                    hex_prefix = b''
+            if i < len(row) - 1:
+                line.append('')
+        else:
+            line.append(_copy_text_value(value))
+    yield ('\t'.join(line) + '\n').encode('utf-8')
+
+
+# COPY text converters for columns holding values of a single type
+_TEXT_CONVERTERS = {
+    int: str,
+    Decimal: str,
+    datetime: lambda x: x.isoformat(' '),
+    date: date.isoformat,
+    bytes: lambda x: '\\\\x' + x.hex(),
+}
+
+
+def _copy_text_column(values):
+    """
+    Serialise a column of a batch for the COPY text format. The converter
+    is chosen once for the column when all its values have the same type,
+    and strings are only escaped if the column holds a character that
+    needs it.
+    Args:
+        values (tuple): Values of the column, in row order.
+    """
+    types = set(map(type, values))
+    has_nulls = type(None) in types
+    types.discard(type(None))
+    value_type = types.pop() if len(types) == 1 else None
+
+    if value_type is str:
+        strings = [x for x in values if x is not None] if has_nulls else values
+        text = ''.join(strings)
+        if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+            values = [x if x is None else _escape_copy_text(x) for x in values]
+        if has_nulls:
+            return ['\\N' if x is None else x for x in values]
+        return values
+
+    convert = _TEXT_CONVERTERS.get(value_type)
+    if convert is None:
+        return [_copy_text_value(x) for x in values]
+    elif has_nulls:
+        return ['\\N' if x is None else convert(x) for x in values]
+    return list(map(convert, values))
+
+
+def _copy_text_batch(data):
+    """
+    Serialise rows for the COPY text format, converting column by column.
+    Args:
+        data (list): Rows to insert, without LOB locators.
+    """
+    columns = [_copy_text_column(x) for x in zip(*data)]
+    return ('\n'.join(map('\t'.join, zip(*columns))) + '\n').encode('utf-8')
+
+
+def _copy_text_rows(data, lob_indexes=None, null_indexes=None, nul_replacement=''):
+    """
+    Generate the COPY text format for a batch of rows. Rows are converted a
+    column at a time, up to COPY_SLICE_ROWS rows at once, and rows holding
+    LOB locators one by one.
+    Args:
+        data (list): Rows to insert.
+        lob_indexes (list): Positions of columns that may hold LOB locators,
+            which are streamed rather than read whole.
+        null_indexes (list): Positions of the columns containing null
+            characters. Values already fetched are cleaned by _remove_nulls,
+            and LOBs are cleaned here as they are streamed.
+        nul_replacement (str): String that replaces null characters.
+    """
+    if not lob_indexes:
+        for start in range(0, len(data), COPY_SLICE_ROWS):
+            yield _copy_text_batch(data[start:start + COPY_SLICE_ROWS])
+        return
+
+    rows = []
+    for row in data:
+        if any(hasattr(row[i], 'read') for i in lob_indexes):
+            if rows:
+                yield _copy_text_batch(rows)
+                rows = []
+            yield from _copy_text_lob_row(row, lob_indexes, null_indexes or (), nul_replacement)
+        else:
+            rows.append(row)
+            if len(rows) == COPY_SLICE_ROWS:
+                yield _copy_text_batch(rows)
+                rows = []
+    if rows:
+        yield _copy_text_batch(rows)
+
+
+# binary COPY header: signature, flags and header extension length
+_COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_COPY_BINARY_TRAILER = struct.pack('!h', -1)
+_COPY_NULL = struct.pack('!i', -1)
+_PG_EPOCH = datetime(2000, 1, 1)
+_PG_EPOCH_DATE = date(2000, 1, 1)
+
+
+def _encode_numeric(value):
+    """
+    Encode a number in the Postgres binary numeric format: base 10000
+    digits with a weight, sign and display scale.
+    Args:
+        value (obj): Decimal, int or float.
+    """
+    if isinstance(value, float):
+        value = Decimal(repr(value))
+    else:
+        value = Decimal(value)
+
+    if value.is_nan():
+        return struct.pack('!ihhHh', 8, 0, 0, 0xC000, 0)
+    if value.is_infinite():
+        raise ValueError('Infinite values cannot be stored as numeric')
+
+    sign, digits, exponent = value.as_tuple()
+    digits = ''.join([str(x) for x in digits])
+    if exponent > 0:
+        digits = digits + '0' * exponent
+        exponent = 0
+    dscale = -exponent
+
+    # split on the decimal point and pad both sides to groups of 4 digits
+    point = len(digits) - dscale
+    if point < 0:
+        digits = '0' * -point + digits
+        point = 0
+    int_part = digits[:point]
+    frac_part = digits[point:]
+    int_part = '0' * (-len(int_part) % 4) + int_part
+    frac_part = frac_part + '0' * (-len(frac_part) % 4)
+
+    groups = [int(int_part[i:i + 4]) for i in range(0, len(int_part), 4)]
+    weight = len(groups) - 1
+    groups = groups + [int(frac_part[i:i + 4]) for i in range(0, len(frac_part), 4)]
+
+    # strip leading and trailing zero groups
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight = weight - 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+        sign = 0
+
+    return struct.pack('!ihhHh{}H'.format(len(groups)), 8 + 2 * len(groups), len(groups),
+                       weight, 0x4000 if sign else 0, dscale, *groups)
+
+
+def _encode_text(value):
+    if hasattr(value, 'read'):
+        value = value.read()
+    if not isinstance(value, str):
+        value = _copy_text_value(value)
+    data = value.encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def _encode_bytea(value):
+    if hasattr(value, 'read'):
+        value = value.read()
+    data = bytes(value)
+    return struct.pack('!i', len(data)) + data
+
+
+def _encode_timestamp(value):
+    delta = value - _PG_EPOCH
+    return struct.pack('!iq', 8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def _encode_timestamptz(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return _encode_timestamp(value)
+
+
+def _encode_date(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return struct.pack('!ii', 4, (value - _PG_EPOCH_DATE).days)
+
+
+def _encode_interval(value):
+    return struct.pack('!iqii', 16, value.seconds * 1000000 + value.microseconds, value.days, 0)
+
+
+# binary encoders for each target type, returning the length prefixed field
+_BINARY_ENCODERS = {
+    'smallint': lambda x: struct.pack('!ih', 2, int(x)),
+    'integer': lambda x: struct.pack('!ii', 4, int(x)),
+    'bigint': lambda x: struct.pack('!iq', 8, int(x)),
+    'real': lambda x: struct.pack('!if', 4, float(x)),
+    'double precision': lambda x: struct.pack('!id', 8, float(x)),
+    'boolean': lambda x: struct.pack('!i?', 1, bool(x)),
+    'numeric': _encode_numeric,
+    'text': _encode_text,
+    'character varying': _encode_text,
+    'character': _encode_text,
+    'bytea': _encode_bytea,
+    'timestamp without time zone': _encode_timestamp,
+    'timestamp with time zone': _encode_timestamptz,
+    'date': _encode_date,
+    'interval': _encode_interval,
+}
+
+
+def _get_binary_encoder(type_name):
+    """
+    Get the binary COPY encoder for a target type. Returns None if the type
+    is not supported.
+    Args:
+        type_name (str): Name of the target type.
+    """
+    return _BINARY_ENCODERS.get(type_name)
+
+
+def _get_binary_encoders(column_keys, column_types, null_indexes=None, nul_replacement=''):
+    """
+    Get the binary COPY encoder of each column of a table. CLOBs are read
+    whole by the text encoder, so null characters in the CLOBs of the given
+    columns are replaced as they are read.
+    Args:
+        column_keys (list): Names of the columns.
+        column_types (dict): Target type name for each column.
+        null_indexes (list): Positions of the columns containing null
+            characters.
+        nul_replacement (str): String that replaces null characters.
+    """
+    def clean(encoder):
+        def encode(value):
+            if hasattr(value, 'read'):
+                value = value.read().replace(chr(0), nul_replacement)
+            return encoder(value)
+        return encode
+
+    encoders = [_get_binary_encoder(column_types[x]) for x in column_keys]
+    for i in null_indexes or []:
+        if encoders[i] is _encode_text:
+            encoders[i] = clean(encoders[i])
+
+    return encoders
+
+
+def _copy_binary_column(values, encoder):
+    """
+    Encode a column of a batch for the COPY binary format.
+    Args:
+        values (tuple): Values of the column, in row order.
+        encoder (obj): Binary encoder of the column.
+    """
+    if type(None) in set(map(type, values)):
+        return [_COPY_NULL if x is None else encoder(x) for x in values]
+    return list(map(encoder, values))
+
+
+def _copy_binary_batch(data, encoders):
+    """
+    Encode rows for the COPY binary format, converting column by column.
+    Args:
+        data (list): Rows to insert, without BLOB locators to stream.
+        encoders (list): Binary encoder for each column.
+    """
+    columns = [_copy_binary_column(x, encoder) for x, encoder in zip(zip(*data), encoders)]
+    field_count = struct.pack('!h', len(encoders))
+    return b''.join(itertools.chain.from_iterable(zip(itertools.repeat(field_count), *columns)))
+
+
+def _copy_binary_lob_row(row, encoders):
+    """
+    Generate the COPY binary format for a row holding BLOB locators,
+    streaming each BLOB in pieces. The length of a BLOB is known up front,
+    so it can be streamed. CLOBs are read whole, as their encoded length is
+    not known until they are read.
+    Args:
+        row (list): Row to insert.
+        encoders (list): Binary encoder for each column.
+    """
+    fields = [struct.pack('!h', len(encoders))]
+    for value, encoder in zip(row, encoders):
+        if value is None:
+            fields.append(_COPY_NULL)
+        elif encoder is _encode_bytea and hasattr(value, 'read'):
+            fields.append(struct.pack('!i', value.size()))
+            yield b''.join(fields)
+            fields = []
+            yield from _read_lob(value)
+        else:
+            fields.append(encoder(value))
+    yield b''.join(fields)
+
+
+def _copy_binary_rows(data, encoders):
+    """
+    Generate the COPY binary format for a batch of rows. Rows are encoded a
+    column at a time, up to COPY_SLICE_ROWS rows at once, and rows holding
+    BLOB locators one by one.
+    Args:
+        data (list): Rows to insert.
+        encoders (list): Binary encoder for each column.
+    """
+    yield _COPY_BINARY_HEADER
+    lob_indexes = [i for i, x in enumerate(encoders) if x is _encode_bytea]
+    rows = []
+    for row in data:
+        if lob_indexes and any(hasattr(row[i], 'read') for i in lob_indexes):
+            if rows:
+                yield _copy_binary_batch(rows, encoders)
+                rows = []
+            yield from _copy_binary_lob_row(row, encoders)
+        else:
+            rows.append(row)
+            if len(rows) == COPY_SLICE_ROWS:
+                yield _copy_binary_batch(rows, encoders)
+                rows = []
+    if rows:
+        yield _copy_binary_batch(rows, encoders)
+    yield _COPY_BINARY_TRAILER
+
+
+def _get_column_string(table):
+    """
+    Create a string of column names for contructing a query.
+    Args:
+        table (obj): SQLAlchemy table object.
+    """
+    column_list = [_quote_column(x) for x in table.columns.keys()]
+    column_str = ', '.join(column_list)
+
+    return column_str
+
+
+def _quote_column(column):
+    """
+    Quote a column name for use in a source query.
+    Args:
+        column (str): Name of the column.
+    """
+    # quote columns that are also keywords.
+    # assume they are upper case!
+    keywords = ['where', 'from', 'select', 'comment', 'order']
+    if column.lower() in keywords:
+        return '"{}"'.format(column.upper())
+    return column
+
+
+def _get_keyset(source_session, source_schema, table):
+    """
+    Choose the key used to page through a source table. Returns the primary
+    key columns, ['rowid'] if the table has no primary key, or None if the
+    table has no usable key (e.g. an index organized table without a primary
+    key).
+    Args:
+        source_session (obj): SQLAlchemy session.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+    """
+    key_columns = [col.name for col in table.primary_key.columns]
+    if key_columns:
+        return key_columns
+
+    # index organized tables only have logical rowids
+    dialect = source_session.get_bind().dialect
+    query = sqlalchemy.text("""SELECT iot_type
+                               FROM all_tables
+                               WHERE owner = :owner
+                               AND table_name = :table_name""")
+    try:
+        row = source_session.execute(query, {'owner': dialect.denormalize_name(source_schema),
+                                             'table_name': dialect.denormalize_name(table.name)}).fetchone()
+    except exc.DBAPIError:
+        return None
+
+    if row is None or row[0]:
+        return None
+
+    return ['rowid']
+
+
+def _keyset_predicate(key_columns):
+    """
+    Build the predicate that seeks past the last key of the previous batch.
+    Oracle does not support row value comparisons such as (a, b) > (:k0, :k1),
+    so the comparison is expanded to a > :k0 OR (a = :k0 AND b > :k1). For
+    composite keys, a leading a >= :k0 is added, which Oracle can use as the
+    start of an index range scan instead of reading the index from the top.
+    Args:
+        key_columns (list): Names of the key columns, in sort order.
+    """
+    clauses = []
+    for i, column in enumerate(key_columns):
+        terms = ['{} = :k{}'.format(_quote_column(x), j) for j, x in enumerate(key_columns[:i])]
+        terms.append('{} > :k{}'.format(_quote_column(column), i))
+        clauses.append('({})'.format(' AND '.join(terms)))
+
+    if len(clauses) == 1:
+        return clauses[0]
+
+    return '{} >= :k0 AND ({})'.format(_quote_column(key_columns[0]), ' OR '.join(clauses))
+
+
+def _is_lob(col_type):
+    """
+    Check whether a source column is a CLOB, NCLOB or BLOB.
+    Args:
+        col_type (obj): SQLAlchemy type of the column.
+    """
+    return isinstance(col_type, (sqlalchemy.types.Text, sqlalchemy.types.LargeBinary)) and \
+        type(col_type).__name__ not in ('LONG', 'BFILE')
+
+
+def _get_fetch_arraysize(table, lob_inline_size=None):
+    """
+    Choose the number of rows fetched from the source per round trip.
+    cx_Oracle allocates buffers for arraysize rows of the declared column
+    sizes, so wide tables fetch fewer rows at a time.
+    Args:
+        table (obj): SQLAlchemy table object.
+        lob_inline_size (int): Largest LOB fetched with the row.
+    """
+    width = 0
+    for col in table.columns:
+        if lob_inline_size and _is_lob(col.type):
+            width = width + lob_inline_size
+        elif isinstance(col.type, (sqlalchemy.types.Text, sqlalchemy.types.LargeBinary)):
+            width = width + 4000
+        elif getattr(col.type, 'length', None):
+            width = width + col.type.length
+        else:
+            width = width + 22
+
+    return max(10, min(FETCH_BUFFER_SIZE // max(width, 1), 10000))
+
+
+# session formats under which Oracle converts numbers and dates to text
+# that COPY accepts
+_COPY_TEXT_NLS = {
+    'NLS_NUMERIC_CHARACTERS': '.,',
+    'NLS_DATE_FORMAT': 'YYYY-MM-DD HH24:MI:SS',
+    'NLS_TIMESTAMP_FORMAT': 'YYYY-MM-DD HH24:MI:SS.FF6',
+    'NLS_TIMESTAMP_TZ_FORMAT': 'YYYY-MM-DD HH24:MI:SS.FF6 TZH:TZM',
+}
+
+
+def _set_nls(cursor, settings):
+    """
+    Change NLS parameters of the source session. Returns the previous
+    values, so they can be restored.
+    Args:
+        cursor (obj): cx_Oracle cursor.
+        settings (dict): Value of each NLS parameter.
+    """
+    cursor.execute("SELECT parameter, value FROM nls_session_parameters")
+    previous = {k: v for k, v in cursor.fetchall() if k in settings}
+    for parameter, value in settings.items():
+        cursor.execute("ALTER SESSION SET {} = '{}'".format(parameter, value.replace("'", "''")))
+
+    return previous
+
+
+def _get_output_handler(text_values=False, lob_inline_size=None):
+    """
+    Build a cx_Oracle output type handler for the extract queries. Other
+    columns are left to the handler of the connection.
+    Args:
+        text_values (bool): Fetch numbers, dates and timestamps as strings,
+            formatted by Oracle under _COPY_TEXT_NLS, so they are passed to
+            COPY text without creating Python objects.
+        lob_inline_size (int): Size of the LOBs in the O2P_INLINE columns,
+            which are fetched as values with the row. The O2P_STREAM
+            columns are fetched as LOB locators, to be read in pieces, and
+            the O2P_LENGTH columns as integers, even with text_values.
+    """
+    def output_handler(cursor, name, default_type, size, precision, scale):
+        if name.startswith('O2P_LENGTH_'):
+            return cursor.var(int, arraysize=cursor.arraysize)
+        elif text_values and default_type in (cx_Oracle.NUMBER, cx_Oracle.DATETIME, cx_Oracle.TIMESTAMP):
+            return cursor.var(cx_Oracle.STRING, 255, arraysize=cursor.arraysize)
+        elif name.startswith('O2P_INLINE_'):
+            var_type = cx_Oracle.LONG_BINARY if default_type == cx_Oracle.BLOB else cx_Oracle.LONG_STRING
+            return cursor.var(var_type, lob_inline_size, arraysize=cursor.arraysize)
+        elif name.startswith('O2P_STREAM_'):
+            return cursor.var(default_type, arraysize=cursor.arraysize)
+        elif cursor.connection.outputtypehandler:
+            return cursor.connection.outputtypehandler(cursor, name, default_type, size, precision, scale)
+
+    return output_handler
+
+
+def _extract_batches(source_session, source_schema, table, batchsize=10000, chunk=None,
+                     start_key=None, where=None, sizer=None, keyed=True, text_values=False,
+                     lob_inline_size=None, stats=None):
+    """
+    Generator that reads a source table in batches through a cx_Oracle
+    cursor, so rows arrive as plain tuples. Each batch is a (rows,
+    last_key) pair: a list of rows, with values in the order of
+    table.columns, and the key of the last row as bind values, or None if
+    the table is read through a single cursor.
+    Args:
+        source_session (obj): SQLAlchemy session.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+        batchsize (int): Number of rows in each batch.
+        chunk (dict): Range or partition of the table to read, from
+            _split_table or _split_by_partition. Reads the whole table if None.
+        start_key (dict): Key of the last row already copied. Reading
+            continues after it.
+        where (tuple): Extra predicate and bind values that rows must match.
+        sizer (obj): _BatchSizer that sets the number of rows in each batch,
+            instead of batchsize. It is told how long each fetch takes.
+        keyed (bool): Page through the table by key, so the key of each
+            batch is known and the copy can be resumed. Otherwise the rows
+            are streamed unordered from a single query.
+        text_values (bool): Fetch numbers, dates and timestamps as strings
+            in the COPY text format. The key values are then strings too,
+            which Oracle converts back when they are bound.
+        lob_inline_size (int): LOBs up to this size, in characters for CLOBs
+            and bytes for BLOBs, are fetched with the row. Larger LOBs are
+            fetched as locators, which the loader reads in pieces.
+        stats (dict): Time spent fetching, and counts and sizes of the LOBs
+            fetched inline and as locators, updated as the table is read.
+    """
+    column_keys = table.columns.keys()
+    lob_columns = []
+    if lob_inline_size:
+        lob_columns = [i for i, x in enumerate(table.columns) if _is_lob(x.type)]
+    if stats is None:
+        stats = {}
+
+    # each LOB is selected as a value if it is small and as a locator if it
+    # is large, with its length after the other columns
+    select_list = [_quote_column(x) for x in column_keys]
+    lob_list = []
+    for i in lob_columns:
+        col = select_list[i]
+        select_list[i] = 'CASE WHEN DBMS_LOB.GETLENGTH({0}) <= :lob_inline THEN {0} END o2p_inline_{1}'.format(col, i)
+        lob_list.append('CASE WHEN DBMS_LOB.GETLENGTH({0}) > :lob_inline THEN {0} END o2p_stream_{1}'.format(col, i))
+        lob_list.append('DBMS_LOB.GETLENGTH({0}) o2p_length_{1}'.format(col, i))
+    columns = ', '.join(select_list)
+    lob_str = ''.join([', {}'.format(x) for x in lob_list])
+
+    cursor = source_session.connection().connection.cursor()
+    cursor.arraysize = _get_fetch_arraysize(table, lob_inline_size)
+    if hasattr(cursor, 'prefetchrows'):
+        # cx_Oracle 8 fetches the first rows with the execute round trip
+        cursor.prefetchrows = cursor.arraysize
+
+    # the handler belongs to this cursor, but the formats are set on the
+    # pooled session, so they are put back when the table is read
+    nls = None
+    if text_values:
+        nls = _set_nls(cursor, _COPY_TEXT_NLS)
+    if text_values or lob_columns:
+        cursor.outputtypehandler = _get_output_handler(text_values, lob_inline_size)
+
+    def fetch(fetch_rows, *args):
+        size = sizer.size if sizer else batchsize
+        start = time.perf_counter()
+        data = fetch_rows(size, *args)
+        elapsed = time.perf_counter() - start
+        stats['fetch_seconds'] = stats.get('fetch_seconds', 0) + elapsed
+        if sizer:
+            sizer.fetched(len(data), elapsed)
+        return data
+
+    def fetch_page(size, query, binds):
+        cursor.execute(query, dict(binds, batchsize=size))
+        return cursor.fetchall()
+
+    # page through the table using the last key seen in the previous batch,
+    # so each batch costs the same regardless of how far into the table it is.
+    # rowid chunks are paged by rowid, which Oracle reads as a range scan.
+    if not keyed and not start_key:
+        key_columns = None
+    elif chunk and chunk['type'] == 'rowid':
+        key_columns = ['rowid']
+    else:
+        key_columns = _get_keyset(source_session, source_schema, table)
+    range_str, range_binds = _chunk_predicate(chunk)
+    from_str = '{}.{}'.format(source_schema, table.name)
+    if chunk and chunk['type'] == 'partition':
+        from_str = '{} PARTITION ("{}")'.format(from_str, chunk['partition'])
+    if where:
+        range_str = ' AND '.join(['({})'.format(x) for x in [range_str, where[0]] if x])
+        range_binds = dict(range_binds, **where[1])
+    if lob_columns:
+        range_binds = dict(range_binds, lob_inline=lob_inline_size)
+
+    width = len(column_keys)
+    if key_columns == ['rowid']:
+        # the rowid is fetched as an extra trailing column
+        select_str = '{}, rowid{}'.format(columns, lob_str)
+        key_index = [width]
+    elif key_columns:
+        select_str = columns + lob_str
+        key_index = [column_keys.index(x) for x in key_columns]
+    elif keyed:
+        msg = '\tNo usable key for {}.{}, copying with a single cursor'.format(source_schema, table.name)
+        logging.info(msg)
+
+    # position of the first LOB locator, after the rowid if there is one
+    lob_index = width + 1 if key_columns == ['rowid'] else width
+
+    def trim(data):
+        if not lob_columns:
+            return [row[:width] for row in data] if lob_index > width else data
+
+        rows = []
+        for row in data:
+            values = list(row[:width])
+            for n, i in enumerate(lob_columns):
+                locator = row[lob_index + 2 * n]
+                length = row[lob_index + 2 * n + 1] or 0
+                if locator is not None:
+                    values[i] = locator
+                    stats['lob_streamed'] = stats.get('lob_streamed', 0) + 1
+                    stats['lob_streamed_size'] = stats.get('lob_streamed_size', 0) + length
+                elif values[i] is not None:
+                    stats['lob_inline'] = stats.get('lob_inline', 0) + 1
+                    stats['lob_inline_size'] = stats.get('lob_inline_size', 0) + length
+                stats['lob_largest'] = max(stats.get('lob_largest', 0), length)
+            rows.append(values)
+        return rows
+
+    try:
+        if key_columns:
+            order_str = ', '.join([_quote_column(x) for x in key_columns])
+            keyset_str = _keyset_predicate(key_columns)
+            first_query = """SELECT {}
+                             FROM {}
+                             {}
+                             ORDER BY {}
+                             FETCH FIRST :batchsize ROWS ONLY""".format(
+                select_str, from_str,
+                'WHERE {}'.format(range_str) if range_str else '', order_str)
+            next_query = """SELECT {}
+                            FROM {}
+                            WHERE {}
+                            ORDER BY {}
+                            FETCH FIRST :batchsize ROWS ONLY""".format(
+                select_str, from_str,
+                '({}) AND ({})'.format(range_str, keyset_str) if range_str else keyset_str, order_str)
+
+            if start_key:
+                data = fetch(fetch_page, next_query, dict(range_binds, **start_key))
+            else:
+                data = fetch(fetch_page, first_query, range_binds)
+            while data:
+                last_key = {'k{}'.format(i): data[-1][x] for i, x in enumerate(key_index)}
+                yield trim(data), last_key
+
+                # load the next chunk of data
+                data = fetch(fetch_page, next_query, dict(range_binds, **last_key))
+        else:
+            query = "SELECT {} FROM {} {}".format(columns + lob_str, from_str,
+                                                  'WHERE {}'.format(range_str) if range_str else '')
+            cursor.execute(query, range_binds)
+            data = fetch(cursor.fetchmany)
+            while data:
+                yield trim(data), None
+                data = fetch(cursor.fetchmany)
+    finally:
+        if nls:
+            _set_nls(cursor, nls)
+        cursor.close()
+
+
+def _remove_nulls(batches, column_indexes, replacement=''):
+    """
+    Generator that replaces null characters in the given columns of each
+    batch, which Postgres cannot store in text. Rows without null characters
+    are passed through unchanged. LOB locators are left as they are, to be
+    cleaned piece by piece as they are streamed into COPY.
+    Args:
+        batches (obj): Generator of batches.
+        column_indexes (list): Positions of the columns to clean.
+        replacement (str): String that replaces each null character. The
+            default removes them.
+    """
+    try:
+        for data, last_key in batches:
+            for i in column_indexes:
+                # most batches have no null characters, which is checked
+                # for the whole column at once
+                if chr(0) not in ''.join([row[i] for row in data if isinstance(row[i], str)]):
+                    continue
+                for n, row in enumerate(data):
+                    value = row[i]
+                    if isinstance(value, str) and chr(0) in value:
+                        row = list(row)
+                        row[i] = value.replace(chr(0), replacement)
+                        data[n] = row
+            yield data, last_key
+    finally:
+        batches.close()
+
+
+# marks the end of the batches passed through a _prefetch queue
+_END_OF_BATCHES = object()
+
+
+def _prefetch(batches, queue_depth=2):
+    """
+    Generator that reads batches on a background thread, keeping up to
+    queue_depth batches ready so the source is read while the target is
+    being loaded. Errors raised while reading are re-raised to the caller.
+    Args:
+        batches (obj): Generator of batches.
+        queue_depth (int): Number of batches to read ahead. Reads in the
+            calling thread if 0.
+    """
+    if not queue_depth:
+        yield from batches
+        return
+
+    batch_queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for batch in batches:
+                put(batch)
+                if stop.is_set():
+                    break
+            put(_END_OF_BATCHES)
+        except Exception as e:
+            put(e)
+        finally:
+            batches.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = batch_queue.get()
+            if item is _END_OF_BATCHES:
+                break
+            elif isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # stop the producer if the caller finishes early
+        stop.set()
+        producer.join()
+
+
+class _BatchSizer(object):
+    """
+    Chooses the number of rows in each batch. The first batch is sized from
+    a byte budget and the estimated row size. After each batch the size is
+    moved up or down, keeping the direction while rows per second improve
+    and turning back with a smaller step when they fall. It is never so
+    large that the batches held at once exceed memory_limit.
+    """
+    min_rows = 100
+    max_rows = 1000000
+
+    def __init__(self, row_bytes, batch_bytes, memory_limit, batches_held):
+        self.row_bytes = row_bytes or 1024
+        self.memory_limit = memory_limit
+        self.batches_held = batches_held
+        self.size = self._limit(batch_bytes // self.row_bytes)
+        self._step = 1.5
+        self._fetch_time = 0.0
+        self._rate = None
+
+    def _limit(self, size):
+        ceiling = self.memory_limit // (self.batches_held * self.row_bytes)
+        return int(max(1, min(max(size, self.min_rows), self.max_rows, ceiling)))
+
+    def fetched(self, rows, seconds):
+        """
+        Record the time taken to fetch a batch from the source.
+        """
+        if rows:
+            self._fetch_time = seconds / rows
+
+    def inserted(self, rows, nbytes, seconds):
+        """
+        Record the size and the time taken to insert a batch, and choose
+        the size of the next batch.
+        """
+        if not rows:
+            return
+        # the row size is averaged with the measured size of each batch,
+        # as the estimate leaves out LOBs stored in line and overhead of
+        # the COPY format
+        self.row_bytes = max(1, (self.row_bytes + nbytes // rows) // 2)
+
+        # fetch and insert overlap, so the slower of the two sets the rate
+        rate = rows / max(seconds, self._fetch_time * rows, 1e-6)
+        if self._rate is not None and rate < self._rate:
+            # turn back with a smaller step, to settle near the best size
+            step = max(abs(math.log(self._step)) / 2, math.log(1.1))
+            self._step = math.exp(-step if self._step > 1 else step)
+        self._rate = rate
+        self.size = self._limit(self.size * self._step)
+
+
+def _copy_data(source_engine,source_schema,target_engine,table,
+               batchsize=10000,trialrun=False,copy_format='text',chunk=None,
+               queue_depth=2,null_columns=None,nul_replacement='',checkpoint=False,
+               progress=None,delta=None,batch_bytes=None,memory_limit=256 * 1024 * 1024,
+               row_bytes=None,fetch_as_text=False,lob_inline_size=None,source_session=None):
+    """
+    Copies the data into the target system. Disables integrity checks
+    prior to inserting.
+    Args:
+        source_engine (obj): Database engine.
+        source_schema (obj): Name of schema to migrate.
+        target_engine (obj): Database engine.
+        table (obj): SQLAlchemy table object.
+        batchsize (int): Number of rows to migrate in each batch.
+        trialrun (bool): Run in trial mode.
+        copy_format (str): COPY format used to load the target, 'text' or 'binary'.
+        chunk (dict): Range or partition of the table to copy, from
+            _split_table or _split_by_partition. Copies the whole table if
+            None. Partitions with a target are copied into that table.
+        queue_depth (int): Number of batches to read ahead of the insert.
+        null_columns (list): Columns containing null characters, found by
+            check_for_nulls.
+        nul_replacement (str): String that replaces null characters.
+        checkpoint (bool): Record the progress of the copy after each batch,
+            so it can be resumed.
+        progress (dict): Progress recorded by an earlier, interrupted copy.
+        delta (dict): Delta settings from _get_deltas. If the table has a
+            watermark, only rows changed since then are copied and merged.
+        batch_bytes (int): Byte budget for a batch. If set, the number of
+            rows in each batch is tuned while copying instead of batchsize.
+        memory_limit (int): Most bytes of batches held in memory at once,
+            when batch_bytes is set.
+        row_bytes (int): Estimated size of a row in bytes.
+        fetch_as_text (bool): Fetch numbers and dates from the source as
+            strings, when the COPY format is text.
+        lob_inline_size (int): LOBs up to this size are fetched with the
+            row, and larger LOBs are streamed into COPY in pieces.
+        source_session (obj): Session to read the source through, instead
+            of a new session bound to source_engine. Used by the benchmark,
+            which has no source database.
+    """
+    # create sessions
+
+    if source_session is None:
+        source_session = Session(bind=source_engine)
+    target_connection = target_engine.raw_connection()
+    target_cursor = target_connection.cursor()
+
+    table_name = table.name
+    if chunk:
+        table_name = '{} ({})'.format(table.name, chunk['id'])
+
+    # print schema
+    msg = '\tBegan copy of {}.{} at {}'.format(source_schema,table_name,
+                                             datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+    logging.info(msg)
+
+    # disable integrity checks for the session
+    target_cursor.execute("SET session_replication_role = replica;")
+
+    if copy_format == 'binary':
+        column_types = _get_target_types(target_cursor, source_schema, table)
+        unsupported = [x for x in table.columns.keys() if not _get_binary_encoder(column_types.get(x))]
+        if unsupported:
+            msg = "\t{}.{}: No binary encoder for columns {}, using text format".format(source_schema,
+                                                                                       table.name, unsupported)
+            logging.info(msg)
+            copy_format = 'text'
+    else:
+        column_types = None
+
+    # a partition is copied straight into its own partition of the target
+    target_table = '{}.{}'.format(_quote_ident(source_schema), _quote_ident(table.name))
+    if chunk and chunk.get('target'):
+        target_table = '{}.{}'.format(_quote_ident(source_schema), _quote_ident(chunk['target']))
+
+    # resume after the last batch recorded by an earlier copy
+    progress = progress or {}
+    offset = progress.get('rows_copied') or 0
+    start_key = progress.get('last_key')
+    if offset and not start_key:
+        # a copy through a single cursor cannot be resumed part way, so the
+        # rows of the table or chunk already copied are removed first
+        msg = '\t{}.{}: Unable to resume copy without a key, restarting'.format(source_schema, table_name)
+        logging.info(msg)
+        if not chunk or chunk.get('target'):
+            target_cursor.execute('TRUNCATE TABLE {}'.format(target_table))
+        elif chunk['type'] == 'pk':
+            # compare strings by code point, as Oracle split the ranges
+            column = _quote_ident(chunk['column'])
+            if isinstance(table.c[chunk['column']].type, sqlalchemy.types.String):
+                column = '{} COLLATE "C"'.format(column)
+            terms = []
+            binds = []
+            for bound, op in [(chunk['lo'], '>='), (chunk['hi'], '<')]:
+                if bound is not None:
+                    terms.append('{} {} %s'.format(column, op))
+                    binds.append(bound)
+            target_cursor.execute('DELETE FROM {} {}'.format(
+                target_table, 'WHERE {}'.format(' AND '.join(terms)) if terms else ''), binds)
+        else:
+            # the rows of other chunks are loaded into the same table
+            raise ValueError('{}.{}: Rows already copied cannot be told apart from other chunks'.format(
+                source_schema, table_name))
+        offset = 0
+    elif offset:
+        msg = '\t{}.{}: Resuming copy after row {}'.format(source_schema, table_name, offset)
+        logging.info(msg)
+
+    # extract the rows changed since the last load, and merge them
+    where = None
+    stage = None
+    if delta and delta['watermark'] is not None:
+        where = _delta_predicate(delta)
+        stage = _create_stage(target_cursor, source_schema, table)
+
+    # batches in the queue, plus one being read and one being inserted
+    sizer = None
+    if batch_bytes:
+        sizer = _BatchSizer(row_bytes, batch_bytes, memory_limit, queue_depth + 2)
+
+    # without checkpoints there is no need to page by key, so the rows are
+    # streamed from a single query
+    stats = {}
+    batches = _extract_batches(source_session, source_schema, table, batchsize, chunk, start_key, where, sizer,
+                               keyed=checkpoint, text_values=fetch_as_text and copy_format == 'text',
+                               lob_inline_size=lob_inline_size, stats=stats)
+
+    # clean the columns that contain null characters as the rows are read
+    null_indexes = None
+    if null_columns:
+        column_keys = table.columns.keys()
+        null_indexes = [column_keys.index(x) for x in null_columns]
+        batches = _remove_nulls(batches, null_indexes, nul_replacement)
+
+    # fetch the next batch from the source while the current one is loaded
+    batches = _prefetch(batches, queue_depth)
+
+    last_key = start_key
+    count = 0
+    cancelled = False
+    fetch_seconds = 0
+    wait_start = time.perf_counter()
+    try:
+        for data, last_key in batches:
+            # insert the data, recording the progress in the same transaction
+            start = time.perf_counter()
+            nbytes = _insert_data(target_cursor,source_schema,table,data,column_types,copy_format,
+                                  stage or target_table, null_indexes, nul_replacement)
+            if stage:
+                _merge_stage(target_cursor, source_schema, table, stage)
+            if checkpoint:
+                _save_progress(target_cursor, source_schema, table.name, chunk, last_key, offset + len(data))
+            target_connection.commit()
+            insert_seconds = time.perf_counter() - start
+            if sizer:
+                sizer.inserted(len(data), nbytes, insert_seconds)
+
+            # the fetch time is read from the extract thread's running total
+            _record_metrics(source_schema, table.name, 'batch', rows=len(data), bytes=nbytes,
+                            fetch_seconds=stats.get('fetch_seconds', 0) - fetch_seconds,
+                            insert_seconds=insert_seconds, wait_seconds=start - wait_start,
+                            batch_seconds=time.perf_counter() - wait_start)
+            fetch_seconds = stats.get('fetch_seconds', 0)
+
+            # print summary
+            msg = '\tCopied rows {}-{} of {}.{} at {}'.format(offset,offset+len(data),
+                source_schema,table_name, datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+            logging.info(msg)
+            offset = offset + len(data)
+            count = count + 1
+
+            # stop at the committed batch once the migration is cancelled
+            if _cancel_event is not None and _cancel_event.is_set():
+                msg = '\t{}.{}: Stopped after row {}, migration cancelled'.format(source_schema, table_name,
+                                                                                  offset)
+                logging.info(msg)
+                cancelled = True
+                break
+
+            # break after a couple of loops
+            if trialrun and count > 1:
+                break
+            wait_start = time.perf_counter()
+    finally:
+        batches.close()
+
+    # a cancelled copy is left unfinished, so it is resumed from its last batch
+    if checkpoint and not cancelled:
+        _save_progress(target_cursor, source_schema, table.name, chunk, last_key, offset, finished=True)
+        target_connection.commit()
+
+    if stage:
+        target_cursor.execute('DROP TABLE {}'.format(stage))
+
+    # sizes are in characters for CLOBs and bytes for BLOBs
+    if 'lob_largest' in stats:
+        msg = '\t{}.{}: LOBs fetched inline: {} (size {}), streamed: {} (size {}), largest: {}'.format(
+            source_schema, table_name, stats.get('lob_inline', 0), stats.get('lob_inline_size', 0),
+            stats.get('lob_streamed', 0), stats.get('lob_streamed_size', 0), stats.get('lob_largest', 0))
+        logging.info(msg)
+        _record_metrics(source_schema, table.name, 'lobs',
+                        **{k: v for k, v in stats.items() if k.startswith('lob_')})
+
+    # enable integrity checks
+    target_cursor.execute("SET session_replication_role = DEFAULT;")
+    target_connection.commit()
+
+    # record end
+    msg = '\tFinished copy of {}.{} at {}'.format(source_schema,table_name,
+                                                datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+    logging.info(msg)
+
+    # close the sessions
+    source_session.close()
+    target_cursor.close()
+    target_connection.close()
+
+
+def _is_unconstrained_number(ora_type):
+    """
+    Check whether a type is a NUMBER without a declared precision, either
+    NUMBER or INTEGER (NUMBER(*,0)), whose range cannot be read from the
+    declaration.
+    Args:
+        ora_type (obj): Data type in the source (Oracle) database.
+    """
+    if isinstance(ora_type, sqlalchemy.types.Float):
+        return False
+    elif isinstance(ora_type, sqlalchemy.types.Numeric):
+        return ora_type.precision is None
+    return type(ora_type) is sqlalchemy.types.INTEGER
+
+
+def _profile_numbers(engine, schema, table):
+    """
+    Scan the NUMBER columns of a table that have no declared precision, in
+    a single pass. Returns a dict of column name to a (largest absolute
+    value, largest number of decimal places) pair.
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table (obj): SQLAlchemy table object, reflected from the source.
+    """
+    columns = [x.name for x in table.columns if _is_unconstrained_number(x.type)]
+    if not columns:
+        return {}
+
+    terms = []
+    for col in columns:
+        col = _quote_column(col)
+        terms.append("MAX(ABS({0})), MAX(CASE WHEN {0} = TRUNC({0}) THEN 0 "
+                     "ELSE LENGTH(TO_CHAR(ABS({0}) - TRUNC(ABS({0})), 'TM9')) - 1 END)".format(col))
+    con = engine.connect()
+    row = con.execute(sqlalchemy.text('SELECT {} FROM {}.{}'.format(', '.join(terms), schema, table.name))).fetchone()
+    con.close()
+
+    return {col: (row[2 * i], row[2 * i + 1]) for i, col in enumerate(columns)}
+
+
+def _narrow_number(precision, scale, profile=None):
+    """
+    Choose the Postgres type for an Oracle NUMBER. Integral numbers become
+    SMALLINT, INTEGER or BIGINT when the declared precision fits, and other
+    numbers NUMERIC(p,s). Numbers without a declared precision are narrowed
+    from the profile of the data, with fractions kept to the largest number
+    of decimal places found. Returns None if the type cannot be narrowed.
+    Args:
+        precision (int): Declared precision, or None.
+        scale (int): Declared scale, or None.
+        profile (tuple): Largest absolute value and number of decimal
+            places found in the column, from _profile_numbers.
+    """
+    if precision is None:
+        if not profile or profile[0] is None:
+            return None
+        # leave one digit of headroom for rows added after the migration
+        digits = len(str(int(profile[0]))) + 1
+        if profile[1]:
+            places = int(profile[1])
+            return NUMERIC(digits + places, places)
+        elif digits <= 9:
+            return INTEGER()
+        elif digits <= 18:
+            return BIGINT()
+        return None
+
+    scale = scale or 0
+    if scale > 0:
+        # Postgres before 15 does not allow a scale larger than the precision
+        return NUMERIC(max(precision, scale), scale)
+
+    # a negative scale rounds to the left of the decimal point
+    digits = precision - scale
+    if digits <= 4:
+        return SMALLINT()
+    elif digits <= 9:
+        return INTEGER()
+    elif digits <= 18:
+        return BIGINT()
+    return NUMERIC(digits, 0)
+
+
+def _convert_type(colname, ora_type, schema_name='',
+                  table_name='', profile=None):
+    """
+    Converts a data type in the source (Oracle) database to a Postgres type.
+    Args:
+        colname (str): Name of the column.
+        ora_type (obj): Data type in the source (Oracle) database.
+        schema_name (str): Name of the schema.
+        table_name (str): Name of the table.
+        profile (tuple): Largest absolute value and number of decimal
+            places, for NUMBER columns without a declared precision.
+    """
+    pg_type = ora_type
+
+    # "NullType is used as a default type for those cases 
+    # where a type cannot be determined"
+    # NB: this needs to be first in the list
+    # Otherwise str(ora_type) clauses will error
+    if isinstance(ora_type, sqlalchemy.types.NullType):
+        pg_type = sqlalchemy.types.String()
+        logging.info('\t{}.{}.{}: NULL DETECTED'.format(schema_name, table_name,
+                                                        colname))
+        return pg_type
+    elif isinstance(ora_type, sqlalchemy.types.Float):
+        pg_type = sqlalchemy.types.Numeric()
+    elif isinstance(ora_type, sqlalchemy.types.Numeric):
+        pg_type = _narrow_number(ora_type.precision, ora_type.scale, profile) or sqlalchemy.types.Numeric()
+    elif type(ora_type) is sqlalchemy.types.INTEGER:
+        # NUMBER(*,0) allows 38 digits, so it is only narrowed from the data
+        pg_type = _narrow_number(None, 0, profile) or NUMERIC(38, 0)
+    elif isinstance(ora_type, sqlalchemy.types.DateTime):
+        pg_type = TIMESTAMP()
+    elif isinstance(ora_type, sqlalchemy.types.Text):
+        pg_type = sqlalchemy.types.Text()
+    elif isinstance(ora_type, sqlalchemy.types.NVARCHAR):
+        pg_type = sqlalchemy.types.VARCHAR()
+    elif isinstance(ora_type, sqlalchemy.types.BLOB):
         pg_type = BYTEA()
     elif str(ora_type) == 'RAW':
         pg_type = BYTEA()
@@ -483,112 +3199,1121 @@ def _convert_type(colname, ora_type, schema_name='',
     else:
         pass
 
-    if pg_type != ora_type:
-        msg = "\t{}.{}.{}: {} converted to {}".format(schema_name, table_name,
-                                                      colname, ora_type, pg_type)
+    if pg_type != ora_type:
+        msg = "\t{}.{}.{}: {} converted to {}".format(schema_name, table_name,
+                                                      colname, ora_type, pg_type)
+        logging.info(msg)
+
+    return pg_type
+
+
+def _run_tasks(func, tasks, source_config, target_config, migration_config, cancel=None):
+    """
+    Run a function for each task, in a pool of worker processes if
+    migration_config['multiprocess'] is set. Tasks are started in order.
+    Returns the result of each task, or None for tasks skipped because the
+    migration was cancelled.
+    Args:
+        func (obj): Function called with the task, source_config,
+            target_config and migration_config.
+        tasks (list): Tasks to run.
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        cancel (obj): threading.Event that stops tasks being started when set.
+    """
+    # set up multiprocessing
+    if migration_config['multiprocess']:
+
+        # set number of processes
+        if migration_config['processes']:
+            processes = int(migration_config['processes'])
+        else:
+            processes = None
+
+        # recycle workers after a number of tables to keep memory bounded
+        tables_per_worker = migration_config.get('tables_per_worker')
+        if tables_per_worker:
+            tables_per_worker = int(tables_per_worker)
+
+        metrics_queue = multiprocessing.Queue()
+        collector = threading.Thread(target=_collect_metrics, args=(metrics_queue,), daemon=True)
+        collector.start()
+
+        worker_cancel = multiprocessing.Event()
+        pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                    initargs=(source_config, target_config, metrics_queue, worker_cancel),
+                                    maxtasksperchild=tables_per_worker)
+
+        # starmap takes an iterable list. chunksize=1 hands out one table at
+        # a time, in order, so the largest tables are started first.
+        arg_iterable = [[task, source_config, target_config, migration_config] for task in tasks]
+        result = pool.starmap_async(func, arg_iterable, chunksize=1)
+        while not result.ready():
+            result.wait(1)
+            if cancel is not None and cancel.is_set():
+                worker_cancel.set()
+        pool.close()
+        pool.join()
+        results = result.get()
+
+        metrics_queue.put(None)
+        collector.join()
+    else:
+        # the tasks check the event as they would in a worker process
+        global _cancel_event
+        _cancel_event = cancel
+        results = []
+        try:
+            for task in tasks:
+                if cancel is not None and cancel.is_set():
+                    results.append(None)
+                    continue
+                results.append(func(task, source_config, target_config, migration_config))
+        finally:
+            _cancel_event = None
+
+    return results
+
+
+class MigrationCancelled(Exception):
+    """
+    Raised by migrate when the migration is cancelled.
+    """
+    pass
+
+
+def migrate(source_config, target_config, migration_config, cancel=None):
+    """
+    Migrate data from the source database to the target database. The target
+    database and schema must already exist.
+    Args:
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        cancel (obj): threading.Event that cancels the migration when set.
+            Tables and chunks already started stop after their current
+            batch, the rest are skipped, and MigrationCancelled is raised.
+            With checkpoints on, the migration can then be resumed.
+    """
+    msg = '\tMigrating data to target database...\n'
+    print(msg)
+
+    # queue the tables, largest first
+    source_engine = connect_to_source(source_config)
+    tasks = _get_table_tasks(source_engine, source_config['schema_list'], migration_config)
+
+    msg = '\t{} tables and chunks queued for migration'.format(len(tasks))
+    logging.info(msg)
+
+    target_engine = connect_to_target(target_config, target_config['database'],
+                                      pool_size=int(migration_config['processes'] or multiprocessing.cpu_count()))
+
+    # record the high-water marks for the next delta load. A resumed
+    # migration keeps the start recorded by the run it picks up from
+    checkpoint = migration_config.get('checkpoint', True)
+    resume = checkpoint and migration_config.get('resume')
+    _create_watermark_table(target_engine)
+    if checkpoint:
+        _create_progress_table(target_engine)
+    delta_start = _load_delta_start(target_engine) if resume else None
+    if delta_start is None:
+        delta_start = _get_delta_start(source_engine)
+
+    # a delta load only extracts rows changed since the last load
+    if migration_config.get('load_type') == 'D':
+        deltas = _get_deltas(target_engine, tasks, migration_config)
+        for task in tasks:
+            task['delta'] = deltas[(task['schema'], task['table'])]
+        if not resume:
+            _truncate_tables(target_engine, [x for x in deltas if deltas[x]['watermark'] is None])
+
+    # record progress, or pick up where an interrupted migration stopped
+    migrated_tasks = tasks
+    if resume:
+        tasks = _resume_tasks(target_engine, tasks)
+    elif checkpoint:
+        _init_progress(target_engine, tasks, delta_start)
+
+    # switch off logging
+    if not migration_config['logged']:
+        _set_logged(target_engine, tasks, False)
+
+    # the workers report metrics to a thread in this process
+    _reset_metrics()
+    for task in tasks:
+        expected_rows = task['size'] // task['row_bytes'] if task.get('row_bytes') else 0
+        _record_metrics(task['schema'], task['table'], 'queued', expected_rows=expected_rows)
+
+    _run_tasks(_migrate_table, tasks, source_config, target_config, migration_config, cancel)
+
+    # switch on database logging, including tables finished by an
+    # interrupted run, which it left unlogged
+    if not migration_config['logged']:
+        _set_logged(target_engine, migrated_tasks, True, migration_config['processes'])
+
+    # a cancelled load is incomplete, so it does not move the watermarks.
+    # Tables finished by an interrupted run are included when it is resumed
+    cancelled = cancel is not None and cancel.is_set()
+    if not cancelled:
+        _save_watermarks(target_engine, migrated_tasks, migration_config, delta_start)
+
+    with _metrics_lock:
+        _metrics['ended'] = time.time()
+        _metrics['cancelled'] = cancelled
+    _write_report(migration_config.get('report_path') or
+                  'logs/{}_migration_report.json'.format(datetime.now().strftime("%Y_%m_%d_%H%M%S")))
+
+    if cancelled:
+        msg = '\tMigration cancelled\n'
         logging.info(msg)
+        print(msg)
+        raise MigrationCancelled()
 
-    return pg_type
+    msg = '\tMigration complete!\n'
+    logging.info(msg)
+    print(msg)
 
 
-def migrate(source_config, target_config, migration_config):
+def _import_pyarrow():
     """
-    Migrate data from the source database to the target database. The target
-    database and schema must already exist.
+    Import pyarrow, which is only needed for Parquet staged files.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("stage_format 'parquet' requires pyarrow, install it with: pip install pyarrow")
+
+    return pyarrow
+
+
+def _get_arrow_schema(pyarrow, source_schema, table):
+    """
+    Build the Arrow schema of a Parquet staged file, with the Arrow type
+    matching the target type of each column. Numbers without a precision
+    Arrow can hold are kept as strings, so no digits are lost.
+    Args:
+        pyarrow (obj): The pyarrow module.
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+    """
+    fields = []
+    for col in table.columns:
+        pg_type = _convert_type(col.name, col.type, schema_name=source_schema, table_name=table.name)
+        if isinstance(pg_type, sqlalchemy.types.SmallInteger):
+            arrow_type = pyarrow.int16()
+        elif isinstance(pg_type, sqlalchemy.types.BigInteger):
+            arrow_type = pyarrow.int64()
+        elif isinstance(pg_type, sqlalchemy.types.Integer):
+            arrow_type = pyarrow.int32()
+        elif isinstance(pg_type, REAL):
+            arrow_type = pyarrow.float32()
+        elif isinstance(pg_type, sqlalchemy.types.Float):
+            arrow_type = pyarrow.float64()
+        elif isinstance(pg_type, sqlalchemy.types.Numeric):
+            if pg_type.precision and pg_type.precision <= 38:
+                arrow_type = pyarrow.decimal128(pg_type.precision, pg_type.scale or 0)
+            else:
+                arrow_type = pyarrow.string()
+        elif isinstance(pg_type, sqlalchemy.types.DateTime):
+            arrow_type = pyarrow.timestamp('us', tz='UTC' if pg_type.timezone else None)
+        elif isinstance(pg_type, sqlalchemy.types.Date):
+            arrow_type = pyarrow.date32()
+        elif isinstance(pg_type, sqlalchemy.types.Interval):
+            arrow_type = pyarrow.duration('us')
+        elif isinstance(pg_type, sqlalchemy.types.LargeBinary):
+            arrow_type = pyarrow.binary()
+        elif isinstance(pg_type, sqlalchemy.types.Boolean):
+            arrow_type = pyarrow.bool_()
+        else:
+            arrow_type = pyarrow.string()
+        fields.append(pyarrow.field(col.name, arrow_type))
+
+    return pyarrow.schema(fields)
+
+
+def _arrow_table(pyarrow, arrow_schema, data, null_indexes=None, nul_replacement=''):
+    """
+    Convert a batch of rows to an Arrow table, column by column.
+    Args:
+        pyarrow (obj): The pyarrow module.
+        arrow_schema (obj): Arrow schema, from _get_arrow_schema.
+        data (list): Rows fetched from the source.
+        null_indexes (list): Positions of the columns containing null
+            characters, which are replaced in the LOBs read here.
+        nul_replacement (str): String that replaces null characters.
+    """
+    columns = []
+    for i, field in enumerate(arrow_schema):
+        values = [row[i] for row in data]
+        # read the LOB locators, and format numbers kept as strings
+        values = [x.read() if x is not None and not isinstance(x, (str, bytes)) and hasattr(x, 'read') else x
+                  for x in values]
+        if null_indexes and i in null_indexes:
+            values = [x.replace(chr(0), nul_replacement) if isinstance(x, str) else x for x in values]
+        if pyarrow.types.is_string(field.type):
+            values = [x if x is None or isinstance(x, str) else str(x) for x in values]
+        elif pyarrow.types.is_decimal(field.type):
+            values = [x if x is None or isinstance(x, Decimal) else Decimal(x) for x in values]
+        columns.append(pyarrow.array(values, type=field.type))
+
+    return pyarrow.Table.from_arrays(columns, schema=arrow_schema)
+
+
+class _StageFile(object):
+    """
+    A staged file being written, holding the rows of one table or chunk:
+    gzip compressed COPY data, or Parquet with one row group per batch.
+    """
+    def __init__(self, path, stage_format='copy', copy_format='text', table=None, column_types=None,
+                 pyarrow=None, arrow_schema=None, null_indexes=None, nul_replacement=''):
+        self.path = path
+        self.rows = 0
+        self._null_indexes = null_indexes
+        self._nul_replacement = nul_replacement
+        self._parquet = stage_format == 'parquet'
+        self._binary = copy_format == 'binary'
+        self._pyarrow = pyarrow
+        self._arrow_schema = arrow_schema
+
+        if self._parquet:
+            self._writer = pyarrow.parquet.ParquetWriter(path, arrow_schema)
+        else:
+            column_keys = table.columns.keys()
+            self._encoders = None
+            if self._binary:
+                self._encoders = _get_binary_encoders(column_keys, column_types, null_indexes, nul_replacement)
+            self._lob_indexes = [i for i, x in enumerate(table.columns) if _is_lob(x.type)]
+            # fast compression, as the extract is meant to be short
+            self._file = gzip.open(path, 'wb', compresslevel=1)
+            if self._binary:
+                self._file.write(_COPY_BINARY_HEADER)
+
+    def write(self, data):
+        """
+        Write a batch of rows. Returns the number of bytes of the batch,
+        before compression.
+        Args:
+            data (list): Rows fetched from the source.
+        """
+        self.rows = self.rows + len(data)
+        if self._parquet:
+            arrow_table = _arrow_table(self._pyarrow, self._arrow_schema, data, self._null_indexes,
+                                       self._nul_replacement)
+            self._writer.write_table(arrow_table)
+            return arrow_table.nbytes
+
+        # the binary header and trailer are written once per file
+        nbytes = 0
+        if self._binary:
+            pieces = _copy_binary_rows(data, self._encoders)
+        else:
+            pieces = _copy_text_rows(data, self._lob_indexes, self._null_indexes, self._nul_replacement)
+        for piece in pieces:
+            if piece is _COPY_BINARY_HEADER or piece is _COPY_BINARY_TRAILER:
+                continue
+            self._file.write(piece)
+            nbytes = nbytes + len(piece)
+
+        return nbytes
+
+    def close(self):
+        """
+        Finish the file. Returns the number of rows and bytes on disk.
+        """
+        if self._parquet:
+            self._writer.close()
+        else:
+            if self._binary:
+                self._file.write(_COPY_BINARY_TRAILER)
+            self._file.close()
+
+        return self.rows, os.path.getsize(self.path)
+
+
+def _stage_table(task, source_config, target_config, migration_config):
+    """
+    Extract a source table or chunk to staged files, starting a new file
+    every migration_config['stage_file_rows'] rows. Returns the columns,
+    formats and files of the table, for the manifest.
     Args:
+        task (dict): Schema, table name, metadata cache path, size, row
+            size and chunk of the table to extract.
         source_config (dict): Settings for source database.
-        target_config (dict): Settings for target database.
+        target_config (dict): Not used, as the target is not written.
         migration_config (dict): Settings for the migration.
     """
-    msg = '\tMigrating data to target database...\n'
+    if _cancel_event is not None and _cancel_event.is_set():
+        msg = '\t{}.{}: Skipped, extract cancelled'.format(task['schema'], task['table'])
+        logging.info(msg)
+        return None
+
+    source_schema = task['schema']
+    chunk = task.get('chunk')
+    source_engine = connect_to_source(source_config)
+    t = _get_cached_table(task['metadata'], source_engine, source_schema, task['table'])
+
+    stage_dir = migration_config.get('stage_dir') or STAGE_DIR
+    stage_format = migration_config.get('stage_format', 'copy')
+    copy_format = migration_config.get('copy_format', 'text')
+    column_types = _get_converted_types(source_schema, t)
+
+    pyarrow = None
+    arrow_schema = None
+    if stage_format == 'parquet':
+        pyarrow = _import_pyarrow()
+        arrow_schema = _get_arrow_schema(pyarrow, source_schema, t)
+        copy_format = None
+    elif copy_format == 'binary':
+        unsupported = [x for x in t.columns.keys() if not _get_binary_encoder(column_types.get(x))]
+        if unsupported:
+            msg = "\t{}.{}: No binary encoder for columns {}, using text format".format(source_schema,
+                                                                                       t.name, unsupported)
+            logging.info(msg)
+            copy_format = 'text'
+
+    table_name = t.name
+    file_name = t.name
+    if chunk:
+        table_name = '{} ({})'.format(t.name, chunk['id'])
+        file_name = '{}_{}'.format(t.name, chunk['id'])
+
+    msg = '\tBegan extract of {}.{} at {}'.format(source_schema, table_name,
+                                                datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"))
+    logging.info(msg)
+
+    os.makedirs(os.path.join(stage_dir, source_schema), exist_ok=True)
+    file_rows = int(migration_config.get('stage_file_rows', 1000000))
+    queue_depth = int(migration_config.get('queue_depth', 2))
+
+    sizer = None
+    batch_bytes = migration_config.get('batch_bytes', 0)
+    if batch_bytes:
+        sizer = _BatchSizer(task.get('row_bytes'), batch_bytes,
+                            migration_config.get('batch_memory', 256 * 1024 * 1024), queue_depth + 2)
+
+    # the files are rewritten if the extract is repeated, so the rows are
+    # streamed from a single query rather than paged by key
+    source_session = Session(bind=source_engine)
+    stats = {}
+    batches = _extract_batches(source_session, source_schema, t, migration_config['batchsize'], chunk,
+                               sizer=sizer, keyed=False,
+                               text_values=migration_config.get('fetch_as_text', False) and copy_format == 'text',
+                               lob_inline_size=migration_config.get('lob_inline_size', 32768), stats=stats)
+
+    null_columns = (migration_config.get('null_columns') or {}).get('{}.{}'.format(source_schema, t.name))
+    nul_replacement = migration_config.get('nul_replacement', '')
+    null_indexes = None
+    if null_columns:
+        column_keys = t.columns.keys()
+        null_indexes = [column_keys.index(x) for x in null_columns]
+        batches = _remove_nulls(batches, null_indexes, nul_replacement)
+
+    batches = _prefetch(batches, queue_depth)
+
+    extension = 'parquet' if stage_format == 'parquet' else 'copy.gz'
+    files = []
+    stage_file = None
+    count = 0
+    fetch_seconds = 0
+    wait_start = time.perf_counter()
+    _record_metrics(source_schema, t.name, 'started')
+    failed = True
+    try:
+        for data, _ in batches:
+            if stage_file is None:
+                path = '{}/{}_{:05d}.{}'.format(source_schema, file_name, len(files), extension)
+                stage_file = _StageFile(os.path.join(stage_dir, path), stage_format, copy_format, t,
+                                        column_types, pyarrow, arrow_schema, null_indexes, nul_replacement)
+
+            start = time.perf_counter()
+            nbytes = stage_file.write(data)
+            write_seconds = time.perf_counter() - start
+            if sizer:
+                sizer.inserted(len(data), nbytes, write_seconds)
+
+            _record_metrics(source_schema, t.name, 'batch', rows=len(data), bytes=nbytes,
+                            fetch_seconds=stats.get('fetch_seconds', 0) - fetch_seconds,
+                            insert_seconds=write_seconds, wait_seconds=start - wait_start,
+                            batch_seconds=time.perf_counter() - wait_start)
+            fetch_seconds = stats.get('fetch_seconds', 0)
+
+            if stage_file.rows >= file_rows:
+                rows, file_bytes = stage_file.close()
+                files.append({'path': path, 'rows': rows, 'bytes': file_bytes})
+                stage_file = None
+
+            # break after a couple of loops
+            count = count + 1
+            if migration_config['trialrun'] and count > 1:
+                break
+            wait_start = time.perf_counter()
+
+        if stage_file is not None:
+            rows, file_bytes = stage_file.close()
+            files.append({'path': path, 'rows': rows, 'bytes': file_bytes})
+            stage_file = None
+        failed = False
+    finally:
+        batches.close()
+        source_session.close()
+        if stage_file is not None:
+            stage_file.close()
+        _record_metrics(source_schema, t.name, 'finished', failed=failed)
+
+    msg = '\tFinished extract of {}.{} at {}: {} rows in {} files'.format(
+        source_schema, table_name, datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"),
+        sum([x['rows'] for x in files]), len(files))
+    logging.info(msg)
+
+    return {'schema': source_schema, 'table': t.name, 'columns': t.columns.keys(), 'column_types': column_types,
+            'copy_format': copy_format, 'files': files}
+
+
+def extract_to_stage(source_config, migration_config, cancel=None):
+    """
+    Extract the source tables to files on local disk, for load_from_stage
+    to load later, without a connection to the target. Each table or chunk
+    is written to files of up to migration_config['stage_file_rows'] rows,
+    either gzip compressed COPY data in migration_config['copy_format'], or
+    Parquet if migration_config['stage_format'] is 'parquet'. A manifest
+    listing the files, and the schema metadata, are written to
+    migration_config['stage_dir'] when every table has been extracted.
+    Args:
+        source_config (dict): Settings for source database.
+        migration_config (dict): Settings for the migration.
+        cancel (obj): threading.Event that cancels the extract when set.
+    """
+    msg = '\tExtracting data to staged files...\n'
     print(msg)
 
-    # set up multiprocessing
-    if migration_config['multiprocess']:
+    stage_dir = migration_config.get('stage_dir') or STAGE_DIR
+    if migration_config.get('stage_format', 'copy') == 'parquet':
+        _import_pyarrow()
 
-        # set number of processes
-        if migration_config['processes']:
-            pool = multiprocessing.Pool(int(migration_config['processes']))
+    # an extract that does not finish leaves no manifest, so it cannot be loaded
+    os.makedirs(stage_dir, exist_ok=True)
+    manifest_path = os.path.join(stage_dir, STAGE_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    source_engine = connect_to_source(source_config)
+    tasks = _get_table_tasks(source_engine, source_config['schema_list'], migration_config)
+
+    msg = '\t{} tables and chunks queued for extract'.format(len(tasks))
+    logging.info(msg)
+
+    _reset_metrics()
+    for task in tasks:
+        expected_rows = task['size'] // task['row_bytes'] if task.get('row_bytes') else 0
+        _record_metrics(task['schema'], task['table'], 'queued', expected_rows=expected_rows)
+
+    results = _run_tasks(_stage_table, tasks, source_config, None, migration_config, cancel)
+
+    cancelled = cancel is not None and cancel.is_set()
+    with _metrics_lock:
+        _metrics['ended'] = time.time()
+        _metrics['cancelled'] = cancelled
+    _write_report(migration_config.get('report_path') or
+                  'logs/{}_extract_report.json'.format(datetime.now().strftime("%Y_%m_%d_%H%M%S")))
+
+    if cancelled:
+        msg = '\tExtract cancelled\n'
+        logging.info(msg)
+        print(msg)
+        raise MigrationCancelled()
+
+    # the load creates the target tables from the metadata of the extract
+    metadata = {}
+    os.makedirs(os.path.join(stage_dir, 'metadata'), exist_ok=True)
+    for schema in source_config['schema_list']:
+        metadata[schema] = 'metadata/{}.pickle'.format(schema)
+        shutil.copyfile(_cache_schema_metadata(source_engine, schema), os.path.join(stage_dir, metadata[schema]))
+
+    # the chunks of a table are listed together
+    tables = {}
+    for result in results:
+        entry = tables.setdefault((result['schema'], result['table']), {
+            'schema': result['schema'], 'table': result['table'], 'columns': result['columns'],
+            'column_types': result['column_types'], 'copy_format': result['copy_format'],
+            'rows': 0, 'files': []})
+        entry['rows'] = entry['rows'] + sum([x['rows'] for x in result['files']])
+        entry['files'].extend(result['files'])
+
+    manifest = {'created': datetime.now().isoformat(),
+                'format': migration_config.get('stage_format', 'copy'),
+                'schema_list': list(source_config['schema_list']),
+                'metadata': metadata,
+                'tables': [tables[x] for x in sorted(tables)]}
+
+    tmp_path = '{}.tmp'.format(manifest_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp_path, manifest_path)
+
+    msg = '\tExtract complete! {} rows of {} tables staged in {}\n'.format(
+        sum([x['rows'] for x in manifest['tables']]), len(manifest['tables']), stage_dir)
+    logging.info(msg)
+    print(msg)
+
+
+def read_manifest(stage_dir=STAGE_DIR):
+    """
+    Read the manifest of a staged extract. The paths of the files and the
+    schema metadata are returned relative to the current directory.
+    Args:
+        stage_dir (str): Directory the files were staged in.
+    """
+    with open(os.path.join(stage_dir, STAGE_MANIFEST)) as f:
+        manifest = json.load(f)
+
+    manifest['metadata'] = {k: os.path.join(stage_dir, v) for k, v in manifest['metadata'].items()}
+    for entry in manifest['tables']:
+        for x in entry['files']:
+            x['path'] = os.path.join(stage_dir, x['path'])
+
+    return manifest
+
+
+def _load_stage_file(item, source_config, target_config, migration_config):
+    """
+    Load a staged file into its target table with COPY. Parquet files are
+    converted to the COPY text format as they are read.
+    Args:
+        item (dict): Schema, table name, columns, formats, path and rows of
+            the staged file.
+        source_config (dict): Not used, as the source is not read.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+    """
+    if _cancel_event is not None and _cancel_event.is_set():
+        msg = '\t{}: Skipped, load cancelled'.format(item['path'])
+        logging.info(msg)
+        return
+
+    source_schema = item['schema']
+    _record_metrics(source_schema, item['table'], 'started')
+    failed = True
+    try:
+        target_engine = connect_to_target(target_config, target_config['database'])
+        target_connection = target_engine.raw_connection()
+        target_cursor = target_connection.cursor()
+        target_cursor.execute("SET session_replication_role = replica;")
+
+        start = time.perf_counter()
+        if item['format'] == 'parquet':
+            pyarrow = _import_pyarrow()
+            parquet_file = pyarrow.parquet.ParquetFile(item['path'])
+
+            def rows():
+                for batch in parquet_file.iter_batches(batch_size=migration_config['batchsize']):
+                    yield from _copy_text_rows(list(zip(*[x.to_pylist() for x in batch.columns])))
+
+            query = "COPY {}.{} ({}) FROM STDIN WITH (FORMAT text)".format(
+                _quote_ident(source_schema), _quote_ident(item['table']),
+                ', '.join([_quote_ident(x) for x in item['columns']]))
+            target_cursor.copy_expert(query, _CopyStream(rows()), size=COPY_BUFFER_SIZE)
         else:
-            pool = multiprocessing.Pool()
+            query = "COPY {}.{} ({}) FROM STDIN WITH (FORMAT {})".format(
+                _quote_ident(source_schema), _quote_ident(item['table']),
+                ', '.join([_quote_ident(x) for x in item['columns']]), item['copy_format'])
+            with gzip.open(item['path'], 'rb') as f:
+                target_cursor.copy_expert(query, f, size=COPY_BUFFER_SIZE)
+        rows = target_cursor.rowcount
+        target_connection.commit()
+        seconds = time.perf_counter() - start
 
-        # starmap takes an iterable list
-        arg_iterable = [[schema, source_config, target_config, migration_config] for schema in
-                        source_config['schema_list']]
-        pool.starmap(_migrate_data, arg_iterable)
-    else:
-        for schema in source_config['schema_list']:
-            _migrate_data(schema, source_config, target_config, migration_config)
+        _record_metrics(source_schema, item['table'], 'batch', rows=rows, bytes=item['bytes'], fetch_seconds=0,
+                        insert_seconds=seconds, wait_seconds=0, batch_seconds=seconds)
 
-    msg = '\tMigration complete!\n'
+        if rows != item['rows']:
+            msg = '\t{}: Loaded {} rows, the manifest lists {} rows'.format(item['path'], rows, item['rows'])
+            logging.warning(msg)
+        else:
+            msg = '\t{}: Loaded {} rows into {}.{}'.format(item['path'], rows, source_schema, item['table'])
+            logging.info(msg)
+        failed = False
+    finally:
+        _record_metrics(source_schema, item['table'], 'finished', failed=failed)
+
+    target_cursor.execute("SET session_replication_role = DEFAULT;")
+    target_connection.commit()
+    target_cursor.close()
+    target_connection.close()
+
+
+def load_from_stage(target_config, migration_config, cancel=None):
+    """
+    Load the files staged by extract_to_stage into the target database, with
+    the files loaded concurrently. The target tables must already exist, and
+    are emptied first, so the load can be repeated.
+    Args:
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration. Uses
+            'stage_dir', and the settings for processes and logging.
+        cancel (obj): threading.Event that cancels the load when set.
+    """
+    msg = '\tLoading staged files to target database...\n'
+    print(msg)
+
+    manifest = read_manifest(migration_config.get('stage_dir') or STAGE_DIR)
+    tables = manifest['tables']
+
+    target_engine = connect_to_target(target_config, target_config['database'],
+                                      pool_size=int(migration_config['processes'] or multiprocessing.cpu_count()))
+
+    # binary COPY data only loads into columns of the types it was encoded for
+    target_connection = target_engine.raw_connection()
+    target_cursor = target_connection.cursor()
+    for entry in tables:
+        if entry['copy_format'] == 'binary':
+            target_types = _get_target_types(target_cursor, entry['schema'], sqlalchemy.table(entry['table']))
+            mismatched = [x for x in entry['columns'] if target_types.get(x) != entry['column_types'][x]]
+            if mismatched:
+                target_connection.close()
+                raise ValueError('{}.{}: Staged binary COPY files do not match the target types of columns {}'
+                                 .format(entry['schema'], entry['table'], mismatched))
+    target_connection.close()
+
+    # reloading replaces the rows of an earlier load
+    _truncate_tables(target_engine, [(x['schema'], x['table']) for x in tables])
+
+    if not migration_config['logged']:
+        _set_logged(target_engine, tables, False)
+
+    # the largest files are started first
+    items = []
+    for entry in tables:
+        for x in entry['files']:
+            items.append(dict(x, schema=entry['schema'], table=entry['table'], columns=entry['columns'],
+                              copy_format=entry['copy_format'], format=manifest['format']))
+    items.sort(key=lambda x: x['bytes'], reverse=True)
+
+    msg = '\t{} staged files queued for load'.format(len(items))
+    logging.info(msg)
+
+    _reset_metrics()
+    for item in items:
+        _record_metrics(item['schema'], item['table'], 'queued', expected_rows=item['rows'])
+
+    _run_tasks(_load_stage_file, items, None, target_config, migration_config, cancel)
+
+    if not migration_config['logged']:
+        _set_logged(target_engine, tables, True, migration_config['processes'])
+
+    cancelled = cancel is not None and cancel.is_set()
+    with _metrics_lock:
+        _metrics['ended'] = time.time()
+        _metrics['cancelled'] = cancelled
+    _write_report(migration_config.get('report_path') or
+                  'logs/{}_load_report.json'.format(datetime.now().strftime("%Y_%m_%d_%H%M%S")))
+
+    if cancelled:
+        msg = '\tLoad cancelled\n'
+        logging.info(msg)
+        print(msg)
+        raise MigrationCancelled()
+
+    msg = '\tLoad complete!\n'
+    logging.info(msg)
+    print(msg)
+
+
+def check_stage_load(target_engine, migration_config):
+    """
+    Compare the row count of each target table with the rows listed in the
+    manifest of the staged files it was loaded from. Returns the tables
+    whose counts differ.
+    Args:
+        target_engine (obj): Database engine.
+        migration_config (dict): Settings for the migration. Uses
+            'stage_dir' and 'processes'.
+    """
+    msg = '\tChecking staged load.\n'
+    print(msg)
+    logging.info(msg)
+
+    manifest = read_manifest(migration_config.get('stage_dir') or STAGE_DIR)
+
+    def count(entry):
+        con = target_engine.connect()
+        try:
+            return con.execute('SELECT count(*) FROM {}.{}'.format(_quote_ident(entry['schema']),
+                                                                   _quote_ident(entry['table']))).scalar()
+        finally:
+            con.close()
+
+    mismatches = []
+    processes = int(migration_config.get('processes') or multiprocessing.cpu_count())
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        counts = list(executor.map(count, manifest['tables']))
+
+    for entry, target_row_ct in zip(manifest['tables'], counts):
+        if entry['rows'] == target_row_ct:
+            msg = "\t{}.{}: Staged and target row count matches ({} rows)".format(entry['schema'], entry['table'],
+                                                                                 target_row_ct)
+            logging.info(msg)
+        else:
+            msg = "\t{}.{}: Staged files have {} rows. Target has {} rows.".format(entry['schema'], entry['table'],
+                                                                                  entry['rows'], target_row_ct)
+            logging.warning(msg)
+            mismatches.append('{}.{}'.format(entry['schema'], entry['table']))
+
+    msg = "\tStaged row count comparison complete: {} mismatches".format(len(mismatches))
     logging.info(msg)
     print(msg)
 
+    return mismatches
+
 
-def check_migration(source_engine, target_engine, source_config):
+def check_migration(source_engine, target_engine, source_config, mode='count', processes=None,
+                    chunks=16, tolerance=0.01, degree=4):
     """
     Carry out post migration integrity checks.
     Args:
         source_engine (obj): Database engine.
         target_engine (obj): Database engine.
         source_config (dict): Settings for source database.
+        mode (str): 'count' compares exact row counts. 'estimate' compares
+            the row counts in the catalog statistics, and counts exactly
+            only the tables where they differ. 'checksum' compares a hash
+            of the content of each key range of each table.
+        processes (int): Number of queries to run concurrently.
+        chunks (int): Number of key ranges per table, for checksums.
+        tolerance (float): Largest relative difference between estimates
+            that is not counted exactly.
+        degree (int): Degree of the Oracle parallel hint for exact counts.
     """
     msg = '\tChecking migration.\n'
     print(msg)
     logging.info(msg)
 
-    # create dict of metadata, with schema_name as key.
-    source_table_details = {}
+    if mode == 'checksum':
+        return _compare_checksums(source_engine, target_engine, source_config['schema_list'],
+                                  processes, chunks)
 
-    SourceSession = sessionmaker(bind=source_engine)
-    source_session = SourceSession()
-    TargetSession = sessionmaker(bind=target_engine)
-    target_session = TargetSession()
+    processes = int(processes or multiprocessing.cpu_count())
+    mismatches = []
 
-    # iterate the source schema to populate source_details
     for schema_name in source_config['schema_list']:
-        source_metadata = sqlalchemy.MetaData(source_engine, quote_schema=True)
-        source_metadata.reflect(schema=schema_name)
-        # source_table_details[schema_name] = source_metadata.tables
+        if mode == 'estimate':
+            tables = _compare_estimates(schema_name, source_engine, target_engine, processes, tolerance)
+        else:
+            tables = sorted(_reflect_schema(source_engine, schema_name).tables.values(), key=lambda x: x.name)
+            tables = [x.name for x in tables]
 
-        target_metadata = sqlalchemy.MetaData(target_engine, quote_schema=True)
-        target_metadata.reflect(schema=schema_name)
+        mismatches.extend(_compare_row_counts(schema_name, source_engine, target_engine, tables,
+                                              processes, degree))
 
-        for t in source_metadata.sorted_tables:
-            # compare row count
-            _compare_row_count(schema_name, source_session, target_session, t, logging)
+    msg = "\tRow count comparison complete: {} mismatches".format(len(mismatches))
+    logging.info(msg)
+    print(msg)
 
-    # close the sessions
-    source_session.close()
-    target_session.close()
+    return mismatches
 
 
-def _compare_row_count(schema_name, source_session, target_session, t, logging):
+def _get_row_estimates(source_engine, target_engine, schema_name):
     """
-    Compare row counts for a table on different sources.
+    Read the estimated row count of each table from the catalog statistics
+    of both databases. Tables without statistics are estimated as None.
     Args:
-        source_session (obj): Database session.
-        target_session (obj): Database session.
-        t (obj): SQLAlchemy table object.
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        schema_name (str): Name of the schema.
     """
-    # count the rows
-    try:
-        source_row_ct = source_session.query(t).count()
-        target_row_ct = target_session.query(t).count()
-    except:
-        msg = "\t{}.{}: Error counting rows.".format(schema_name, t.name)
-        logging.error(msg)
+    con = source_engine.connect()
+    result = con.execute(sqlalchemy.text("""
+        SELECT table_name, num_rows
+        FROM all_tables
+        WHERE owner = :owner"""), {'owner': source_engine.dialect.denormalize_name(schema_name)}).fetchall()
+    con.close()
+    source_rows = {source_engine.dialect.normalize_name(name): rows for name, rows in result}
 
-    # compare the rows
-    try:
-        if source_row_ct == target_row_ct:
-            msg = "\t{}.{}: Source and target row count matches ({} rows)".format(schema_name,
-                                                                                t.name, source_row_ct)
-            logging.info(msg)
+    # reltuples is -1 on tables that have never been analyzed
+    con = target_engine.connect()
+    result = con.execute(sqlalchemy.text("""
+        SELECT c.relname, CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples::bigint END
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema
+        AND c.relkind IN ('r', 'p')"""), {'schema': schema_name}).fetchall()
+    con.close()
+    target_rows = dict(result)
+
+    return source_rows, target_rows
+
+
+def _compare_estimates(schema_name, source_engine, target_engine, processes=None, tolerance=0.01):
+    """
+    Compare the estimated row counts of the tables in a schema. Only the
+    tables reflected from the source are compared, which leaves out
+    temporary tables and IOT overflow segments. The target tables are
+    analyzed first, as they are usually not yet analyzed after the load.
+    Returns the tables whose estimates are missing or differ by more than
+    the tolerance, or that could not be analyzed, which need an exact count.
+    Args:
+        schema_name (str): Name of the schema.
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        processes (int): Number of tables to analyze concurrently.
+        tolerance (float): Largest relative difference that is accepted.
+    """
+    table_names = sorted([x.name for x in _reflect_schema(source_engine, schema_name).tables.values()])
+
+    def analyze(table_name):
+        con = target_engine.connect()
+        try:
+            con.execution_options(autocommit=True).execute(
+                'ANALYZE {}.{}'.format(_quote_ident(schema_name), _quote_ident(table_name)))
+        except exc.DBAPIError:
+            msg = "\t{}.{}: Error analyzing target table.".format(schema_name, table_name)
+            logging.error(msg)
+            return False
+        finally:
+            con.close()
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        analyzed = dict(zip(table_names, executor.map(analyze, table_names)))
+
+    source_rows, target_rows = _get_row_estimates(source_engine, target_engine, schema_name)
+
+    tables = []
+    for table_name in table_names:
+        source_row_ct = source_rows.get(table_name)
+        target_row_ct = target_rows.get(table_name)
+        if not analyzed[table_name] or source_row_ct is None or target_row_ct is None or \
+                abs(source_row_ct - target_row_ct) > tolerance * max(source_row_ct, target_row_ct):
+            tables.append(table_name)
         else:
-            msg = "\t{}.{}: Source has {} rows. Target has {} rows.".format(schema_name,
-                                                                          t.name, source_row_ct, target_row_ct)
-            logging.warning(msg)
-    except:
-        msg = "\t{}.{}: Unable to compare row counts.".format(schema_name, t.name)
-        logging.error(msg)
+            msg = "\t{}.{}: Source and target row estimates match (about {} rows)".format(
+                schema_name, table_name, source_row_ct)
+            logging.info(msg)
+
+    msg = "\t{}: Row estimates differ for {} of {} tables".format(schema_name, len(tables), len(table_names))
+    logging.info(msg)
+
+    return tables
+
+
+def _compare_row_counts(schema_name, source_engine, target_engine, tables, processes=None, degree=4):
+    """
+    Compare exact row counts for tables on different sources. The tables
+    are counted concurrently, and Oracle is asked to scan each table in
+    parallel. Returns the tables whose counts differ.
+    Args:
+        schema_name (str): Name of the schema.
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        tables (list): Names of the tables to count.
+        processes (int): Number of tables to count concurrently.
+        degree (int): Degree of the Oracle parallel hint.
+    """
+    def count(engine, query):
+        con = engine.connect()
+        try:
+            return con.execute(query).scalar()
+        finally:
+            con.close()
+
+    mismatches = []
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        counts = []
+        for table_name in tables:
+            source_query = 'SELECT /*+ PARALLEL(t, {}) */ COUNT(*) FROM {}.{} t'.format(
+                int(degree or 1), schema_name, table_name)
+            target_query = 'SELECT count(*) FROM {}.{}'.format(_quote_ident(schema_name), _quote_ident(table_name))
+            counts.append((table_name,
+                           executor.submit(count, source_engine, source_query),
+                           executor.submit(count, target_engine, target_query)))
+
+        for table_name, source_future, target_future in counts:
+            try:
+                source_row_ct = source_future.result()
+                target_row_ct = target_future.result()
+            except exc.DBAPIError:
+                msg = "\t{}.{}: Error counting rows.".format(schema_name, table_name)
+                logging.error(msg)
+                mismatches.append('{}.{}'.format(schema_name, table_name))
+                continue
+
+            if source_row_ct == target_row_ct:
+                msg = "\t{}.{}: Source and target row count matches ({} rows)".format(schema_name,
+                                                                                    table_name, source_row_ct)
+                logging.info(msg)
+            else:
+                msg = "\t{}.{}: Source has {} rows. Target has {} rows.".format(schema_name,
+                                                                              table_name, source_row_ct, target_row_ct)
+                logging.warning(msg)
+                mismatches.append('{}.{}'.format(schema_name, table_name))
+
+    return mismatches
+
+
+def _checksum_columns(table):
+    """
+    Build matching Oracle and Postgres expressions that format each column
+    of a table as the same text on both databases. LOB, LONG, float and
+    interval columns have no common text format and are left out. Returns
+    a list of (column name, Oracle expression, Postgres expression, width).
+    Args:
+        table (obj): SQLAlchemy table object, reflected from the source.
+    """
+    columns = []
+    for col in table.columns:
+        ora_col = _quote_column(col.name)
+        pg_col = _quote_ident(col.name)
+        type_name = type(col.type).__name__
+
+        if type_name in ('LONG', 'BINARY_FLOAT', 'BINARY_DOUBLE') or \
+                isinstance(col.type, (sqlalchemy.types.Text, sqlalchemy.types.LargeBinary,
+                                      sqlalchemy.types.Interval)):
+            continue
+        elif type_name in ('CHAR', 'NCHAR'):
+            # Postgres drops the blank padding when char is cast to text
+            columns.append((col.name, 'RTRIM({})'.format(ora_col), 'rtrim({}::text)'.format(pg_col),
+                            col.type.length or 2000))
+        elif isinstance(col.type, sqlalchemy.types.String):
+            columns.append((col.name, ora_col, '{}::text'.format(pg_col), col.type.length or 4000))
+        elif type_name == 'RAW':
+            columns.append((col.name, 'RAWTOHEX({})'.format(ora_col), "upper(encode({}, 'hex'))".format(pg_col),
+                            2 * (col.type.length or 2000)))
+        elif type_name == 'DATE':
+            columns.append((col.name, "TO_CHAR({}, 'YYYY-MM-DD HH24:MI:SS')".format(ora_col),
+                            "to_char({}, 'YYYY-MM-DD HH24:MI:SS')".format(pg_col), 19))
+        elif isinstance(col.type, (sqlalchemy.types.DateTime, sqlalchemy.types.Date)):
+            columns.append((col.name, "TO_CHAR({}, 'YYYY-MM-DD HH24:MI:SS.FF6')".format(ora_col),
+                            "to_char({}, 'YYYY-MM-DD HH24:MI:SS.US')".format(pg_col), 26))
+        elif isinstance(col.type, (sqlalchemy.types.Numeric, sqlalchemy.types.Integer)):
+            # TM9 has no trailing zeros and no leading zero before the
+            # decimal point, so the Postgres text is trimmed to match
+            columns.append((col.name, "TO_CHAR({}, 'TM9')".format(ora_col),
+                            "CASE WHEN {0}::text LIKE '%.%' "
+                            "THEN regexp_replace(rtrim(rtrim({0}::text, '0'), '.'), '^(-?)0[.]', '\\1.') "
+                            "ELSE {0}::text END".format(pg_col), 40))
+
+    return columns
+
+
+def _checksum_queries(source_schema, table, chunk):
+    """
+    Build the Oracle and Postgres queries that count the rows of a key
+    range and sum a hash of each row. The sum does not depend on the order
+    of the rows. Wide rows are hashed in groups of columns, to stay within
+    the Oracle limit of 4000 bytes for a concatenated string.
+    Args:
+        source_schema (str): Name of the schema.
+        table (obj): SQLAlchemy table object.
+        chunk (dict): Key range from _split_by_key, or None for the table.
+    """
+    groups = [[]]
+    width = 0
+    for column in _checksum_columns(table):
+        if groups[-1] and width + column[3] + 1 > 4000:
+            groups.append([])
+            width = 0
+        groups[-1].append(column)
+        width = width + column[3] + 1
+
+    # the first 60 bits of the MD5 hash of each row, as a number
+    ora_sums = []
+    pg_sums = []
+    for group in groups:
+        ora_row = " || '|' || ".join([x[1] for x in group]) or "'|'"
+        pg_row = " || '|' || ".join(["coalesce({}, '')".format(x[2]) for x in group]) or "'|'"
+        ora_sums.append("SUM(TO_NUMBER(SUBSTR(RAWTOHEX(STANDARD_HASH({} || '|', 'MD5')), 1, 15), "
+                        "'XXXXXXXXXXXXXXX'))".format(ora_row))
+        pg_sums.append("sum(('x' || substr(md5({} || '|'), 1, 15))::bit(60)::bigint)".format(pg_row))
+
+    ora_where, binds = _chunk_predicate(chunk)
+    pg_where = None
+    if chunk:
+        # compare strings by code point, as Oracle does by default
+        pg_col = _quote_ident(chunk['column'])
+        if isinstance(table.c[chunk['column']].type, sqlalchemy.types.String):
+            pg_col = '{} COLLATE "C"'.format(pg_col)
+        terms = []
+        if chunk['lo'] is not None:
+            terms.append('{} >= :lo'.format(pg_col))
+        if chunk['hi'] is not None:
+            terms.append('{} < :hi'.format(pg_col))
+        pg_where = ' AND '.join(terms)
+
+    ora_query = 'SELECT COUNT(*), {} FROM {}.{} {}'.format(', '.join(ora_sums), source_schema, table.name,
+                                                          'WHERE {}'.format(ora_where) if ora_where else '')
+    pg_query = 'SELECT count(*), {} FROM {}.{} {}'.format(', '.join(pg_sums), _quote_ident(source_schema),
+                                                         _quote_ident(table.name),
+                                                         'WHERE {}'.format(pg_where) if pg_where else '')
+
+    return sqlalchemy.text(ora_query), sqlalchemy.text(pg_query), binds
+
+
+def _compare_checksums(source_engine, target_engine, schema_list, processes=None, chunks=16):
+    """
+    Compare the content of the source and target tables. Each table is
+    split into key ranges, and the row count and hash sum of every range is
+    computed on both databases concurrently. Mismatches are reported for
+    each range. Text is hashed as bytes in the database character set, so
+    the source should use AL32UTF8 for non-ASCII text to match.
+    Returns a list of the tables and ranges that do not match.
+    Args:
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        schema_list (list): List of schema.
+        processes (int): Number of queries to run concurrently.
+        chunks (int): Number of key ranges per table.
+    """
+    def run(engine, query, binds):
+        con = engine.connect()
+        try:
+            return [int(x or 0) for x in con.execute(query, binds).fetchone()]
+        finally:
+            con.close()
+
+    processes = int(processes or multiprocessing.cpu_count())
+    mismatches = []
+
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        checks = []
+        for schema_name in schema_list:
+            source_metadata = _reflect_schema(source_engine, schema_name)
+            for t in source_metadata.sorted_tables:
+                skipped = [x.name for x in t.columns if x.name not in [y[0] for y in _checksum_columns(t)]]
+                if skipped:
+                    msg = "\t{}.{}: Columns not checksummed: {}".format(schema_name, t.name, skipped)
+                    logging.info(msg)
+
+                for chunk in _split_by_key(source_engine, schema_name, t.name, chunks) or [None]:
+                    ora_query, pg_query, binds = _checksum_queries(schema_name, t, chunk)
+                    checks.append((schema_name, t.name, chunk,
+                                   executor.submit(run, source_engine, ora_query, binds),
+                                   executor.submit(run, target_engine, pg_query, binds)))
+
+        for schema_name, table_name, chunk, source_future, target_future in checks:
+            name = '{}.{}'.format(schema_name, table_name)
+            if chunk:
+                name = '{} ({} from {} to {})'.format(name, chunk['column'], chunk['lo'], chunk['hi'])
+            try:
+                source_sums = source_future.result()
+                target_sums = target_future.result()
+            except exc.DBAPIError as e:
+                msg = "\t{}: Unable to compare checksums: {}".format(name, e)
+                logging.error(msg)
+                mismatches.append(name)
+                continue
+
+            if source_sums == target_sums:
+                msg = "\t{}: Source and target checksums match ({} rows)".format(name, source_sums[0])
+                logging.info(msg)
+            else:
+                msg = "\t{}: Checksums differ. Source has {} rows. Target has {} rows.".format(
+                    name, source_sums[0], target_sums[0])
+                logging.warning(msg)
+                mismatches.append(name)
+
+    msg = "\tChecksum comparison complete: {} mismatches".format(len(mismatches))
+    logging.info(msg)
+    print(msg)
+
+    return mismatches
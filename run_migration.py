@@ -8,9 +8,10 @@ Running the script will delete the target database before recreating it, so
 use with caution!
 """
 import sys
+import multiprocessing
 import oracle2postgres
 
-def run(config):
+def run(config, cancel=None):
 
     #oracle2postgres.create_logfile()
 
@@ -19,30 +20,80 @@ def run(config):
     target_config = config['target_config']
     migration_config = config['migration_config']
 
-    # check the schema exist on the source database
-    source_engine = oracle2postgres.connect_to_source(source_config)
-    oracle2postgres.check_schema_exist(source_engine,source_config['schema_list'])
+    # size the connection pools for the phases that run one connection per process
+    pool_size = int(migration_config['processes'] or multiprocessing.cpu_count())
 
-    # check and remove null characters in strings
-    oracle2postgres.check_for_nulls(source_engine,source_config['schema_list'],remove=True)
+    # a staged migration runs in two phases: 'extract' writes the source
+    # tables to files without touching the target, and 'load' loads the
+    # files without touching the source
+    stage = migration_config.get('stage')
+    if stage and migration_config['load_type'] != 'F':
+        raise ValueError("Staged migrations only support load_type 'F'")
 
+    schema_list = source_config['schema_list']
+    metadata_paths = None
+    if stage == 'load':
+        source_engine = None
+        manifest = oracle2postgres.read_manifest(migration_config.get('stage_dir') or oracle2postgres.STAGE_DIR)
+        schema_list = manifest['schema_list']
+        metadata_paths = manifest['metadata']
+    else:
+        # check the schema exist on the source database
+        source_engine = oracle2postgres.connect_to_source(source_config,pool_size=pool_size)
+        oracle2postgres.check_schema_exist(source_engine,source_config['schema_list'])
 
-    target_engine = oracle2postgres.connect_to_target(target_config)
-    oracle2postgres.drop_connections(target_config['database'],target_engine)
-    oracle2postgres.drop_database(target_config['database'],target_engine)
-    oracle2postgres.create_database(target_config['database'],target_engine)
+        # check for null characters in strings, which are removed during the copy
+        null_columns = oracle2postgres.check_for_nulls(source_engine,source_config['schema_list'],remove=True,
+                                                       processes=migration_config['processes'])
+        migration_config = dict(migration_config, null_columns=null_columns)
+
+    if stage == 'extract':
+        oracle2postgres.extract_to_stage(source_config, migration_config, cancel=cancel)
+        oracle2postgres.dispose_engines()
+        return
+
+
+    # a resumed migration keeps the target database and the rows already copied,
+    # and a delta load ('D') merges changed rows into the existing target
+    resume = migration_config.get('resume', False)
+
+    if not resume and migration_config['load_type'] != 'D':
+        target_engine = oracle2postgres.connect_to_target(target_config)
+        oracle2postgres.drop_connections(target_config['database'],target_engine)
+        oracle2postgres.drop_database(target_config['database'],target_engine)
+        oracle2postgres.create_database(target_config['database'],target_engine)
 
 
 
     # create the schema on the target database
-    target_engine = oracle2postgres.connect_to_target(target_config,target_config['database'])
-    if migration_config['load_type'] == 'P' or migration_config['load_type'] == 'F':
-        oracle2postgres.create_target_schema(source_config['schema_list'],source_engine,target_engine)
+    target_engine = oracle2postgres.connect_to_target(target_config,target_config['database'],pool_size=pool_size)
+    if not resume and (migration_config['load_type'] == 'P' or migration_config['load_type'] == 'F'):
+        oracle2postgres.create_target_schema(schema_list,source_engine,target_engine,
+                                             profile=migration_config.get('profile_numbers', False),
+                                             metadata_paths=metadata_paths)
 
-    if migration_config['load_type'] == "F" or migration_config['load_type'] == "D":
-        oracle2postgres.migrate(source_config, target_config, migration_config)
+    # a cancelled job stops before the next phase
+    if cancel is not None and cancel.is_set():
+        raise oracle2postgres.MigrationCancelled()
+
+    if stage == 'load':
+        oracle2postgres.load_from_stage(target_config, migration_config, cancel=cancel)
+    elif migration_config['load_type'] == "F" or migration_config['load_type'] == "D":
+        oracle2postgres.migrate(source_config, target_config, migration_config, cancel=cancel)
+
+    # the tables are loaded without keys or indexes, so build them afterwards
+    if migration_config['load_type'] == "F":
+        oracle2postgres.create_constraints(schema_list,source_engine,target_engine,
+                                           migration_config,metadata_paths=metadata_paths)
 
     # check results
-    source_engine = oracle2postgres.connect_to_source(source_config)
-    target_engine = oracle2postgres.connect_to_target(target_config, target_config['database'])
-    oracle2postgres.check_migration(source_engine, target_engine, source_config)
+    if stage == 'load':
+        oracle2postgres.check_stage_load(target_engine, migration_config)
+    else:
+        oracle2postgres.check_migration(source_engine, target_engine, source_config,
+                                        mode=migration_config.get('check_mode', 'count'),
+                                        processes=migration_config['processes'],
+                                        tolerance=migration_config.get('count_tolerance', 0.01),
+                                        degree=migration_config.get('count_degree', 4))
+
+    oracle2postgres.dispose_engines()
@@ -0,0 +1,56 @@
+import os
+import unittest
+from unittest import mock
+
+# the module logs to logs/ in the working directory
+os.makedirs('logs', exist_ok=True)
+import oracle2postgres  # noqa: E402
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks = [{'schema': 'hr', 'table': 'employees', 'metadata': None, 'size': 200,
+                       'row_bytes': None, 'chunk': None},
+                      {'schema': 'hr', 'table': 'jobs', 'metadata': None, 'size': 100,
+                       'row_bytes': None, 'chunk': None}]
+        self.migration_config = {'processes': 2, 'logged': False, 'checkpoint': True, 'resume': True,
+                                 'report_path': '/dev/null'}
+
+    def _migrate(self, resumed):
+        with mock.patch.multiple(oracle2postgres,
+                                 connect_to_source=mock.DEFAULT,
+                                 connect_to_target=mock.DEFAULT,
+                                 _get_table_tasks=mock.Mock(return_value=list(self.tasks)),
+                                 _create_watermark_table=mock.DEFAULT,
+                                 _create_progress_table=mock.DEFAULT,
+                                 _load_delta_start=mock.Mock(return_value={'scn': 1, 'timestamp': None}),
+                                 _resume_tasks=mock.Mock(return_value=resumed),
+                                 _init_progress=mock.DEFAULT,
+                                 _run_tasks=mock.DEFAULT,
+                                 _save_watermarks=mock.DEFAULT,
+                                 _write_report=mock.DEFAULT,
+                                 _set_logged=mock.DEFAULT) as mocks:
+            oracle2postgres.migrate({'schema_list': ['hr']}, {'database': 'db'}, self.migration_config)
+        return mocks
+
+    def test_resume_logs_finished_tables(self):
+        # employees was finished by the interrupted run, jobs was not
+        mocks = self._migrate([self.tasks[1]])
+
+        unlogged, logged = mocks['_set_logged'].call_args_list
+        self.assertEqual(unlogged[0][1], [self.tasks[1]])
+        self.assertFalse(unlogged[0][2])
+        self.assertEqual(logged[0][1], self.tasks)
+        self.assertTrue(logged[0][2])
+
+    def test_resume_saves_all_watermarks(self):
+        mocks = self._migrate([self.tasks[1]])
+
+        mocks['_run_tasks'].assert_called_once()
+        self.assertEqual(mocks['_run_tasks'].call_args[0][1], [self.tasks[1]])
+        self.assertEqual(mocks['_save_watermarks'].call_args[0][1], self.tasks)
+
+
+if __name__ == '__main__':
+    unittest.main()